@@ -1,27 +1,47 @@
 import streamlit as st
-import pandas as pd
-from io import BytesIO
 import uuid
+from services.excel import file_digest, load_table, to_excel_bytes
+from services.comparison import apply_mappings, compare_dataframes, result_cache, ADDED, REMOVED, MODIFIED, UNCHANGED
+from services.result_store import get_result_store
 
 st.title("增长汪汪 - 面向产品运营团队的 BI 数据分析工具")
 
 st.header("数据比较")
 
 st.subheader("上传 Excel 数据源")
-st.warning("数据隐私保护：上传的 Excel 文件不会被存储在任何云端而仅是被读取到服务器的内存中，当你刷新页面后这些数据会被清除。")
-
-file1 = st.file_uploader("上传第一个文件", type=["xlsx", "xls"])
-file2 = st.file_uploader("上传第二个文件", type=["xlsx", "xls"])
-
-def compare_with_same_headers(df1, df2):
+st.warning("数据隐私保护：上传的 Excel 文件不会被存储在任何云端，比较结果仅临时保存在服务器本地磁盘上用于分页浏览，超出空间上限后会被自动清除。")
+
+file1 = st.file_uploader("上传第一个文件", type=["xlsx", "xls", "csv", "parquet"])
+file2 = st.file_uploader("上传第二个文件", type=["xlsx", "xls", "csv", "parquet"])
+
+def select_key_columns(columns):
+    # 选择比较方式：按行号逐行比较，或者按关键列匹配行后比较
+    mode = st.radio("比较方式", ["按行号逐行比较", "按关键列匹配比较"], horizontal=True)
+    if mode == "按行号逐行比较":
+        return []
+
+    key_columns = st.multiselect("请选择用于匹配行的关键列（可多选）", list(dict.fromkeys(columns)))
+    if not key_columns:
+        st.info("请至少选择一个关键列来匹配两个文件中的行。")
+        st.stop()
+    return key_columns
+
+def warn_row_count_mismatch(df1, df2, key_columns):
+    # 按行号比较时行数不一致，多出的行会显示为与空值的差异，中间插入或删除的行还会让后续行错位
+    if not key_columns and len(df1) != len(df2):
+        st.warning(f"两个文件的行数不一致（文件1：{len(df1)} 行，文件2：{len(df2)} 行），多出的行将显示为差异。"
+                   "如果文件中插入或删除了行，建议使用“按关键列匹配比较”。")
+
+def compare_with_same_headers(df1, df2, file_key):
     st.success("检测到表头一致，正在进行比较。")
-    proceed_to_compare = True
-    if proceed_to_compare:
-        mapped_columns = df1.columns.tolist()
-        df_all = highlight_differences(df1, df2, mapped_columns)
-        display_and_download_results(df_all)
-
-def compare_with_different_headers(df1, df2):
+    mapped_columns = df1.columns.tolist()
+    key_columns = select_key_columns(mapped_columns)
+    warn_row_count_mismatch(df1, df2, key_columns)
+    result_key = (file_key, tuple(mapped_columns), tuple(key_columns))
+    display_and_download_results(result_key, lambda: compare_dataframes(df1, df2, mapped_columns, key_columns),
+                                 mapped_columns)
+
+def compare_with_different_headers(df1, df2, file_key):
     st.warning("表头不一致，请进行列映射。")
     st.write("请选择列的对应关系（可以动态添加和删除）：")
 
@@ -51,110 +71,100 @@ def compare_with_different_headers(df1, df2):
         mapping['col1'] = col1
         mapping['col2'] = col2
 
+    key_columns = select_key_columns([mapping['col1'] for mapping in st.session_state.mappings])
+    warn_row_count_mismatch(df1, df2, key_columns)
+
+    mapping_pairs = tuple((mapping['col1'], mapping['col2']) for mapping in st.session_state.mappings)
+
     # 应用映射关系
     if st.button('完成映射'):
-        if st.session_state.mappings:
-            df2_mapped = apply_mappings(df2, st.session_state.mappings)
-            # 获取映射后的列名列表
-            mapped_columns = [mapping['col1'] for mapping in st.session_state.mappings]
-            df_all = highlight_differences(df1, df2_mapped, mapped_columns)
-            display_and_download_results(df_all)
-        else:
+        if not st.session_state.mappings:
             st.warning("请至少添加一个列的对应关系。")
             st.stop()
-    else:
+        st.session_state.completed_mappings = mapping_pairs
+
+    # 映射关系确认之后，勾选筛选等操作触发的重新执行继续展示结果，直到映射关系被修改
+    if not mapping_pairs or st.session_state.get('completed_mappings') != mapping_pairs:
         st.info("添加列的对应关系并点击“完成映射”按钮来进行数据比较。")
         st.stop()  # 等待用户完成映射后再继续
 
-def apply_mappings(df2, mappings):
-    # 将 df2 的列名按照映射关系重命名为 df1 的列名
-    mapping_dict = {mapping['col2']: mapping['col1'] for mapping in mappings}
-    df2_mapped = df2.rename(columns=mapping_dict)
-    # 只保留映射后的列
-    df2_mapped = df2_mapped[list(mapping_dict.values())]
-    return df2_mapped
-
-def highlight_differences(df1, df2_mapped, mapped_columns):
-    # df1: 原始的 df1 数据框，包含所有列
-    # df2_mapped: 根据映射关系重命名后的 df2 数据框，只包含映射后的列
-    # mapped_columns: 映射后的列名列表（来自 df1）
-
-    # 重置索引以确保正确对齐
-    df1.reset_index(drop=True, inplace=True)
-    df2_mapped.reset_index(drop=True, inplace=True)
-
-    # 创建一个新的 DataFrame，包含 df1 的所有数据
-    df_all = df1.copy()
-
-    # 创建一个空的 DataFrame，用于存储差异标记
-    df_all_diff = pd.DataFrame('', index=df1.index, columns=mapped_columns)
-
-    # 比较映射的列，创建差异标记
-    comparison_values = df1[mapped_columns].values == df2_mapped[mapped_columns].values
-    rows, cols = df1[mapped_columns].shape
-    for i in range(rows):
-        for j in range(cols):
-            if not comparison_values[i, j]:
-                col_name = mapped_columns[j]
-                df_all_diff.at[i, col_name] = f"{df1.at[i, col_name]} --> {df2_mapped.at[i, col_name]}"
-
-    # 将差异结果添加到 df_all 中
-    for column in mapped_columns:
-        df_all[f"{column}_差异"] = df_all_diff[column]
-
-    # 添加一个列，标记每一行是否有差异
-    df_all['是否有差异'] = df_all_diff.apply(lambda x: '有差异' if any(x != '') else '无差异', axis=1)
-
-    return df_all
+    df2_mapped = apply_mappings(df2, st.session_state.mappings)
+    # 获取映射后的列名列表
+    mapped_columns = [mapping['col1'] for mapping in st.session_state.mappings]
+    result_key = (file_key, mapping_pairs, tuple(key_columns))
+    display_and_download_results(result_key, lambda: compare_dataframes(df1, df2_mapped, mapped_columns, key_columns),
+                                 mapped_columns)
 
 def highlight_diff_cells(data, diff_columns):
     def apply_highlight(val):
         return 'background-color: yellow' if val != '' else ''
     return data.style.applymap(apply_highlight, subset=diff_columns)
 
-def display_and_download_results(df_all):
-    # 添加筛选控件
-    show_differences_only = st.checkbox("仅显示有差异的行", value=False)
+def display_and_download_results(result_key, compare, mapped_columns):
+    # 比较结果写入磁盘上的结果存储，相同的比较只计算一次；页面只读取当前页的行
+    with st.spinner("正在比较数据，请稍候..."):
+        store = get_result_store(result_key, compare, mapped_columns)
 
-    if show_differences_only:
-        df_display = df_all[df_all['是否有差异'] == '有差异']
-    else:
-        df_display = df_all
+    st.write(f"共 {len(store)} 行，其中有差异的行：{store.changed_rows} 行")
 
-    # 显示前10行结果
-    st.write("比较结果（前 10 行）：")
-    df_display_head = df_display.head(10)
+    # 按关键列比较时，汇总新增、删除和修改的行数
+    if store.diff_type_counts is not None:
+        counts = store.diff_type_counts
+        st.write("，".join(f"{diff_type}：{counts.get(diff_type, 0)} 行" for diff_type in [ADDED, REMOVED, MODIFIED, UNCHANGED]))
 
-    # 直接显示数据，不应用高亮样式
-    st.dataframe(df_display_head)
-
-    # 导出完整的比较结果
-    def to_excel(df):
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='比较结果')
-        processed_data = output.getvalue()
-        return processed_data
-
-    excel_data = to_excel(df_all)
-
-    # 提供下载按钮导出数据
-    st.download_button(
-        label="下载完整的比较结果 Excel 文件",
-        data=excel_data,
-        file_name='比较结果.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    # 添加筛选控件
+    changed_counts = store.changed_counts()
+    show_differences_only = st.checkbox("仅显示有差异的行", value=False)
+    changed_columns = st.multiselect(
+        "仅显示以下列有差异的行（可多选，需同时满足）",
+        [column for column in changed_counts if changed_counts[column]],
+        format_func=lambda column: f"{column}（{changed_counts[column]} 行有差异）",
     )
+    rows = store.filter_rows(show_differences_only, changed_columns)
+    total = len(store) if rows is None else len(rows)
+
+    # 分页显示结果
+    cols = st.columns([1, 1, 2])
+    with cols[0]:
+        page_size = st.selectbox("每页行数", [10, 50, 100, 500])
+    page_count = max(1, -(-total // page_size))
+    with cols[1]:
+        # 筛选条件、结果行数或每页行数变化后回到第一页
+        page_number = st.number_input("页码", min_value=1, max_value=page_count, value=1, step=1,
+                                      key=f"result_page_{total}_{show_differences_only}_{changed_columns!r}_{page_size}")
+    with cols[2]:
+        st.write(f"第 {page_number} / {page_count} 页，符合条件的行：{total} 行")
+
+    # 直接显示数据，不应用高亮样式
+    st.dataframe(store.page((page_number - 1) * page_size, page_size, rows))
+
+    # 导出完整的比较结果：只在用户请求时生成，生成后缓存复用
+    excel_data = result_cache.get(("xlsx", result_key))
+    if excel_data is None and st.button("生成完整的比较结果 Excel 文件"):
+        # 完整的结果数据框只在导出时重新计算，生成文件后即释放
+        with st.spinner("正在生成 Excel 文件，请稍候..."):
+            excel_data = to_excel_bytes(compare(), sheet_name='比较结果')
+        result_cache.put(("xlsx", result_key), excel_data)
+
+    if excel_data is not None:
+        # 提供下载按钮导出数据
+        st.download_button(
+            label="下载完整的比较结果 Excel 文件",
+            data=excel_data,
+            file_name='比较结果.xlsx',
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
 
 if file1 and file2:
-    # 读取文件
-    df1 = pd.read_excel(file1)
-    df2 = pd.read_excel(file2)
+    # 读取文件，相同内容的文件只解析一次
+    df1 = load_table(file1)
+    df2 = load_table(file2)
+    file_key = (file_digest(file1), file_digest(file2))
 
     # 检测表头是否一致
     if df1.columns.tolist() == df2.columns.tolist():
-        compare_with_same_headers(df1, df2)
+        compare_with_same_headers(df1, df2, file_key)
     else:
-        compare_with_different_headers(df1, df2)
+        compare_with_different_headers(df1, df2, file_key)
 else:
     st.info("请上传两个 Excel 文件以进行比较。")
@@ -1,60 +1,14 @@
+import json
+import os
 import streamlit as st
-import pandas as pd
-from langchain_core.messages import AIMessage, HumanMessage
-from services.llm import get_llm_model
-from io import BytesIO
-
-model = get_llm_model()
-
-def to_excel(df):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    processed_data = output.getvalue()
-    return processed_data
-
-
-def detect_anomalies_per_column(df, selected_columns, detection_rules):
-    results = {}
-    for column in selected_columns:
-        texts = df[column].astype(str).tolist()
-        rule = detection_rules.get(column, "")
-        anomalies = []
-        for text in texts:
-            resp = model.invoke([
-                AIMessage(content=f"""
-你是一名数据分析助手。
-请根据以下检测规则，判断给定的文本是否**符合**规则。
-
-- 如果文本符合检测规则，请回答“是”；
-- 如果文本不符合检测规则，请回答“否”。
-
-请仅回答“是”或“否”，不需要任何解释。
-
-**示例 1**：
-- 检测规则：文本长度小于 10
-- 文本：hello
-- 回答：是
-
-**示例 2**：
-- 检测规则：包含英文
-- 文本：你好
-- 回答：否
-"""),
-                HumanMessage(content=f"""
-检测规则：{rule} 
-文本：{text}
-回答：
-""")
-            ])
-            result = resp.content
-            print(f"文本: {text}，检测结果: {result}")
-            anomalies.append(result)
-        results[column] = anomalies
-    return results
-
-
-def process_file(df):
+from services.anomaly import dedupe_checks, RESULT_FILE
+from services.excel import load_table
+from services.jobs import submit_job, get_job, delete_job, job_file, QUEUED, RUNNING, FAILED, JOB_STORAGE_NOTICE
+
+JOB_KIND = "anomaly"
+
+
+def process_file(df, uploaded_file):
     st.subheader("数据预览（前 10 行）")
     st.dataframe(df.head(10))
 
@@ -72,41 +26,91 @@ def process_file(df):
                     rule = st.text_area(f"请输入 {column} 列的检测规则", key=f"rule_{column}")
                     detection_rules[column] = rule
 
+            packed = st.checkbox("多行打包检测（每次请求合并多行文本，速度更快、消耗更少 token）", value=True)
+            compile_rules = st.checkbox("规则编译（长度、正则、数值范围等机械规则由大模型翻译成表达式后直接计算，"
+                                        "只有无法编译的规则逐条调用大模型）", value=True)
+
             if st.button("开始检测"):
                 if all(detection_rules.values()):
-                    with st.spinner("正在筛选正确数据，请稍候..."):
-                        # 调用异常检测函数
-                        anomaly_results = detect_anomalies_per_column(df, selected_columns, detection_rules)
-                        # 将检测结果添加到数据框中
-                        for column in selected_columns:
-                            df[f"{column}_检测结果"] = anomaly_results[column]
-                    st.subheader("检测结果（前 10 行）")
-                    st.dataframe(df.head(10))
-
-                    # 将 DataFrame 转换为 Excel 格式
-                    excel_data = to_excel(df)
-
-                    # 提供下载按钮导出数据
-                    st.download_button(
-                        label="下载检测结果 Excel 文件",
-                        data=excel_data,
-                        file_name='检测结果.xlsx',
-                        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    )
+                    checks, _ = dedupe_checks(df, selected_columns, detection_rules)
+                    total_cells = len(df) * len(selected_columns)
+                    st.info(f"共 {total_cells} 个单元格，去重后需要检测 {len(checks)} 条文本"
+                            f"（去重比例 {total_cells / max(len(checks), 1):.1f}:1）")
+                    # 检测在后台工作进程中执行，任务 ID 记录在页面地址中，刷新页面后可以继续查看进度和结果
+                    input_name = f"input{os.path.splitext(uploaded_file.name)[1].lower()}"
+                    job_id = submit_job(JOB_KIND, {
+                        "input": input_name,
+                        "columns": selected_columns,
+                        "rules": list(detection_rules.items()),
+                        "packed": packed,
+                        "compile_rules": compile_rules,
+                    }, files={input_name: uploaded_file.getvalue()})
+                    st.query_params["job"] = job_id
         else:
             st.warning("请先选择要处理的文本列。")
     else:
         st.warning("尚未实现该功能。")
 
 
+@st.fragment(run_every=2)
+def show_job_progress(job_id):
+    job = get_job(job_id)
+    if job["status"] not in (QUEUED, RUNNING):
+        # 任务结束后重新执行整个页面，展示检测结果
+        st.rerun()
+    if job["status"] == QUEUED or not job["total"]:
+        st.progress(0.0, text="任务排队中，请稍候...")
+    else:
+        st.progress(job["completed"] / job["total"], text=f"已检测 {job['completed']}/{job['total']} 条文本")
+
+
+def show_job(job_id):
+    job = get_job(job_id)
+    if job is None or job["kind"] != JOB_KIND:
+        return
+
+    st.subheader("检测任务")
+    if job["status"] in (QUEUED, RUNNING):
+        show_job_progress(job_id)
+    elif job["status"] == FAILED:
+        st.error(f"检测任务失败：{job['error']}")
+    else:
+        compiled_rules = job["summary"].get("compiled_rules")
+        if compiled_rules:
+            st.info("以下规则已编译为表达式直接计算：\n" + "\n".join(
+                f"- {rule}：`{json.dumps(spec, ensure_ascii=False)}`" for rule, spec in compiled_rules.items()))
+        result_path = job_file(job_id, RESULT_FILE)
+        st.subheader("检测结果（前 10 行）")
+        st.dataframe(load_table(result_path).head(10))
+
+        # 提供下载按钮导出数据
+        with open(result_path, "rb") as f:
+            st.download_button(
+                label="下载检测结果 Excel 文件",
+                data=f.read(),
+                file_name='检测结果.xlsx',
+                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+
+    if st.button("关闭任务", help="关闭后立即删除该任务上传的文件和结果"):
+        delete_job(job_id)
+        del st.query_params["job"]
+        st.rerun()
+
+
 st.title("检测数据源中的异常值")
 st.info("请上传一个 Excel 文件，然后选择要处理的列并撰写检测规则。")
 
+st.warning(JOB_STORAGE_NOTICE)
+
 uploaded_file = st.file_uploader("请选择一个 Excel 文件", type=["xlsx", "xls"])
 
 if uploaded_file is not None:
-    df = pd.read_excel(uploaded_file)
+    df = load_table(uploaded_file)
     st.success("文件上传成功！")
-    process_file(df)
+    process_file(df, uploaded_file)
 else:
     st.warning("请先上传一个 Excel 文件。")
+
+if "job" in st.query_params:
+    show_job(st.query_params["job"])
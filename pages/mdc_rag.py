@@ -1,103 +1,101 @@
+import time
+# 从导入依赖开始计时，冷启动耗时包含模块导入时间
+page_start = time.perf_counter()
 import os
 import streamlit as st
-import pandas as pd
-from langchain_core.messages import SystemMessage, HumanMessage
-from services.llm import get_llm_model
+from services.department_matcher import EXACT_MATCH, FUZZY_MATCH, LLM_MATCH
+from services.department_matching import CANDIDATE_COLUMN, PHYSICAL_COLUMNS, RESULT_COLUMN, RESULT_FILE
+from services.excel import get_sheet_names, load_table
+from services.jobs import (submit_job, get_job, delete_job, get_job_results_since, job_file, QUEUED, RUNNING, FAILED,
+                           JOB_STORAGE_NOTICE)
+from services.timing import record_page_load, page_load_report
 import logging
-from langchain import hub
-from langchain_openai import OpenAIEmbeddings
-from langchain_postgres.vectorstores import PGVector
-
-# Prepare the embeddings
-
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-
-prompt = hub.pull("rlm/rag-prompt")
-
-connection = os.getenv("DATABASE_URL")
-collection_name = "hospital_departments"
-vectorstore = PGVector(
-    embeddings=embeddings,
-    collection_name=collection_name,
-    connection=connection,
-    use_jsonb=True,
-)
-
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 6})
-
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-logger = logging.getLogger()
-
-def match_departments(dept_physical_level2, dept_physical_level1, dept_intro, candidate_departments, retriever):
-    # 构建查询
-    query = f"二级科室：{dept_physical_level2}，科室简介：{dept_intro}"
-
-    # 检索相关文档
-    retrieved_docs = retriever.invoke(query)
-
-    # 格式化检索到的文档作为上下文
-    context = "\n\n".join([doc.page_content for doc in retrieved_docs])
-
-    model = get_llm_model(max_tokens=200)
-
-    logger.info(f"RAG 过程中查询到的上下文: {context}")
-
-    resp = model.invoke([
-        SystemMessage(content=f"""
-你将扮演医疗行业助手，负责将待匹配的科室与候选科室列表进行最合适的匹配。请基于提供的一级科室、科室简介、语义理解、医学常识作出判断，分析待匹配科室与候选科室之间的相关性，按照相关性高低排列输出 1 个或者多个匹配结果。请仅从参考文档的二级科室以及候选科室列表中挑选科室，不能匹配出参考文档和候选科室列表中不存在的科室。
-如果参考文档中有匹配的二级科室，它们的优先级最高。
-
-参考文档：
-{context}
-
-执行要求：
-1. 匹配逻辑：根据科室的一级科室、科室简介、名称、疾病、症状等信息进行匹配。如果需要，可以搜索相关疾病或症状以进一步确认匹配结果。
-2. 分析步骤：可以参考分析过程的思路并且一步步地进行分析，详细分析待匹配科室和背景中提到的关键词，如年龄段、疾病类型等，并结合候选科室做出合理推测。
-3. 输出格式：请只要输出“匹配结果”的内容，不能包含“匹配结果：”这一标题，“分析过程”部分可以隐去。
-
-案例
-参考文档：
-- 一级科室: 内科
-- 二级科室: 神经内科
-
-- 待匹配科室： 炎性肌病多学科联合门诊
-- 待匹配科室的一级科室：多学科联合门诊(MDT)
-- 待匹配科室的简介：我院炎性肌病多学科联合门诊由风湿免疫科神经内科、心血管内科、病理科、呼吸内科等五个相关科室医生组成
-- 候选科室列表：风湿免疫科、神经内科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
-- 匹配结果：神经内科、风湿免疫科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
-        """),
-        HumanMessage(content=f"""
-- 待匹配科室：{dept_physical_level2}
-- 待匹配科室的一级科室：{dept_physical_level1}
-- 待匹配科室的简介：{dept_intro if pd.notna(dept_intro) and dept_intro and dept_intro != 'nan' else "无"}
-- 候选科室列表：{', '.join(candidate_departments)}
-- 匹配结果：
-        """)
-    ])
-
-    reply = resp.content
-
-    logger.info(f"科室名称: {dept_physical_level2}, 一级科室名称：{dept_physical_level1}, 简介：{dept_intro}, 科室候选：{candidate_departments}, 匹配结果: {reply}")
+JOB_KIND = "department_matching"
+# 匹配前先从科室向量库中检索参考文档
+RAG = True
+
+
+@st.fragment(run_every=2)
+def show_job_progress(job_id):
+    job = get_job(job_id)
+    if job["status"] not in (QUEUED, RUNNING):
+        # 任务结束后重新执行整个页面，展示完整的匹配结果
+        st.rerun()
+    if job["status"] == QUEUED or not job["total"]:
+        st.progress(0.0, text="任务排队中，请稍候...")
+        return
+    st.progress(job["completed"] / job["total"], text=f"已匹配 {job['completed']}/{job['total']} 个科室")
+
+    # 已完成的匹配结果逐行填入预览表格：输入表格按任务只读取一次，之后每次只获取新写入的结果
+    preview = st.session_state.get(f"job_preview_{job_id}")
+    if preview is None:
+        df_sheet2 = load_table(job_file(job_id, job["params"]["input"]), sheet_name=job["params"]["sheet2"])
+        df_sheet2[RESULT_COLUMN] = None
+        preview = st.session_state[f"job_preview_{job_id}"] = {"df": df_sheet2, "after": 0}
+    results, preview["after"] = get_job_results_since(job_id, preview["after"])
+    items = [item for item in results if item < len(preview["df"])]
+    if items:
+        preview["df"].loc[items, RESULT_COLUMN] = [results[item] for item in items]
+    st.dataframe(preview["df"])
+
+
+def show_job(job_id):
+    job = get_job(job_id)
+    if job is None or job["kind"] != JOB_KIND or job["params"]["rag"] != RAG:
+        return
+
+    st.subheader("匹配结果预览")
+    if job["status"] not in (QUEUED, RUNNING):
+        # 任务结束后释放进度预览
+        st.session_state.pop(f"job_preview_{job_id}", None)
+
+    if job["status"] in (QUEUED, RUNNING):
+        show_job_progress(job_id)
+    elif job["status"] == FAILED:
+        st.error(f"匹配任务失败：{job['error']}")
+    else:
+        result_path = job_file(job_id, RESULT_FILE)
+        st.dataframe(load_table(result_path, sheet_name=job["params"]["sheet2"]))
+        tier_counts = job["summary"]
+        st.info("，".join(f"{tier} {tier_counts.get(tier, 0)} 行" for tier in [EXACT_MATCH, FUZZY_MATCH, LLM_MATCH]))
+
+        # 提供下载
+        with open(result_path, "rb") as f:
+            st.download_button(
+                label="下载匹配结果",
+                data=f.read(),
+                file_name="匹配结果.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+    if st.button("关闭任务", help="关闭后立即删除该任务上传的文件和结果"):
+        delete_job(job_id)
+        del st.query_params["job"]
+        st.rerun()
 
-    return reply
 
 st.title("医疗科室分类工具")
 
 st.header("上传 Excel 文件")
 
+st.warning(JOB_STORAGE_NOTICE)
+
 uploaded_file = st.file_uploader("上传包含两个工作表的 Excel 文件", type=["xlsx", "xls"])
 
-if uploaded_file:
-    # 获取 Excel 文件对象
-    excel_file = pd.ExcelFile(uploaded_file)
+# 记录页面加载耗时，跟踪冷启动和热启动的变化
+record_page_load("mdc_rag", time.perf_counter() - page_start)
+with st.sidebar.expander("页面加载耗时"):
+    st.dataframe(page_load_report(), hide_index=True)
 
+if uploaded_file:
     # 获取所有工作表名称
-    sheet_names = excel_file.sheet_names
+    sheet_names = get_sheet_names(uploaded_file)
 
     # 选择工作表
     sheet1_name = st.selectbox("选择候选科室列表所在的工作表（Sheet 1）", sheet_names, key='sheet1')
@@ -105,8 +103,8 @@ if uploaded_file:
     sheet2_name = st.selectbox("选择需要匹配的工作表（Sheet 2）", remaining_sheet_names, key='sheet2')
 
     # 读取工作表
-    df_sheet1 = pd.read_excel(uploaded_file, sheet_name=sheet1_name)
-    df_sheet2 = pd.read_excel(uploaded_file, sheet_name=sheet2_name)
+    df_sheet1 = load_table(uploaded_file, sheet_name=sheet1_name)
+    df_sheet2 = load_table(uploaded_file, sheet_name=sheet2_name)
 
     st.subheader(f"{sheet1_name} 前 10 行预览")
     st.write(df_sheet1.head(10))
@@ -115,8 +113,8 @@ if uploaded_file:
     st.write(df_sheet2.head(10))
 
     # 定义所需的列名
-    required_columns_sheet1 = ['二级科室']  # Sheet1 中需要的列名
-    required_columns_sheet2 = ['二级科室（物理科室）', '一级科室（物理科室）', '科室简介（物理科室）']  # Sheet2 中需要的列名
+    required_columns_sheet1 = [CANDIDATE_COLUMN]  # Sheet1 中需要的列名
+    required_columns_sheet2 = PHYSICAL_COLUMNS  # Sheet2 中需要的列名
 
     # 检查 Sheet1 是否包含所需的列
     missing_columns_sheet1 = [col for col in required_columns_sheet1 if col not in df_sheet1.columns]
@@ -133,54 +131,16 @@ if uploaded_file:
         st.error(error_message)
     else:
         # 所有列名都匹配，继续处理
-        # 获取列名
-        column_candidate_depts = required_columns_sheet1[0]
-        column_physical_level2 = required_columns_sheet2[0]
-        column_physical_level1 = required_columns_sheet2[1]
-        column_intro = required_columns_sheet2[2]
-
         if st.button("开始匹配"):
-            with st.spinner('正在匹配，请稍候...'):
-                # 获取候选科室列表
-                candidate_departments = df_sheet1[column_candidate_depts].dropna().astype(str).unique().tolist()
-
-                # 初始化结果列表
-                results = []
-
-                # 遍历 Sheet 2 的每一行
-                for idx, row in df_sheet2.iterrows():
-                    dept_physical_level2 = str(row[column_physical_level2])
-                    dept_physical_level1 = str(row[column_physical_level1])
-                    dept_intro = str(row[column_intro])
-
-                    matched_depts = match_departments(dept_physical_level2, dept_physical_level1, dept_intro,
-                                                      candidate_departments, retriever)
-
-                    results.append(matched_depts)
-
-                # 将匹配结果添加到 DataFrame
-                df_sheet2['二级科室（标准科室）'] = results
-
-                st.subheader("匹配结果预览")
-                st.write(df_sheet2.head(10))
-
-
-                # 提供下载
-                def convert_df_to_excel(df):
-                    from io import BytesIO
-                    output = BytesIO()
-                    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-                    df.to_excel(writer, index=False, sheet_name=sheet2_name)
-                    writer.close()
-                    processed_data = output.getvalue()
-                    return processed_data
-
-
-                excel_data = convert_df_to_excel(df_sheet2)
-
-                st.download_button(
-                    label="下载匹配结果",
-                    data=excel_data,
-                    file_name="匹配结果.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            # 匹配在后台工作进程中执行，任务 ID 记录在页面地址中，刷新页面后可以继续查看进度和结果
+            input_name = f"input{os.path.splitext(uploaded_file.name)[1].lower()}"
+            job_id = submit_job(JOB_KIND, {
+                "input": input_name,
+                "sheet1": sheet1_name,
+                "sheet2": sheet2_name,
+                "rag": RAG,
+            }, files={input_name: uploaded_file.getvalue()})
+            st.query_params["job"] = job_id
+
+if "job" in st.query_params:
+    show_job(st.query_params["job"])
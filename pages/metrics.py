@@ -0,0 +1,57 @@
+import time
+import pandas as pd
+import streamlit as st
+from services.metrics import (flush, latency_buckets, load_metrics, prometheus_text, summarize, CACHE_HITS, ERRORS,
+                              REQUESTS)
+
+TIME_RANGES = {
+    "最近 1 小时": 3600,
+    "最近 24 小时": 24 * 3600,
+    "最近 7 天": 7 * 24 * 3600,
+}
+
+st.title("大模型调用监控")
+st.info("统计页面和后台任务中每次大模型、embeddings 请求的吞吐量、延迟、token 用量、重试、缓存命中和失败，数据每隔几秒写入一次。")
+
+time_range = st.selectbox("时间范围", list(TIME_RANGES))
+since = time.time() - TIME_RANGES[time_range]
+
+# 先写入当前进程中尚未落盘的指标
+flush()
+df = load_metrics(since)
+
+if df.empty:
+    st.warning("所选时间范围内没有大模型调用记录。")
+    st.stop()
+
+scopes = sorted(df["scope"].unique())
+selected_scopes = st.multiselect("页面或任务类型", scopes, default=scopes)
+kinds = st.multiselect("调用类型", ["chat", "embedding"], default=["chat", "embedding"])
+df = df[df["scope"].isin(selected_scopes) & df["kind"].isin(kinds)]
+
+st.subheader("汇总")
+st.dataframe(summarize(df), hide_index=True)
+
+st.subheader("每分钟请求数")
+per_minute = df[df["name"].isin([REQUESTS, ERRORS, CACHE_HITS])].pivot_table(
+    index="minute", columns="name", values="value", aggfunc="sum", fill_value=0)
+per_minute.index = pd.to_datetime(per_minute.index, unit="s")
+st.line_chart(per_minute.rename(columns={REQUESTS: "请求数", ERRORS: "失败数", CACHE_HITS: "缓存命中数"}))
+
+st.subheader("延迟分布")
+buckets = latency_buckets(df)
+buckets.index = [f"≤ {upper:g}s" if upper != float("inf") else "> 60s" for upper in buckets.index]
+st.bar_chart(buckets.rename("请求数"))
+
+st.subheader("按任务统计")
+jobs = df[df["job_id"] != ""]
+if jobs.empty:
+    st.write("暂无后台任务的调用记录。")
+else:
+    st.dataframe(summarize(jobs, by=("scope", "job_id", "kind")), hide_index=True)
+
+with st.expander("Prometheus 文本格式"):
+    st.write("也可以运行 `python -m services.metrics --port 9464`，由 Prometheus 从 `/metrics` 抓取。")
+    text = prometheus_text(since)
+    st.code(text, language="text")
+    st.download_button("下载指标", data=text, file_name="metrics.txt", mime="text/plain")
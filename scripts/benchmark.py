@@ -0,0 +1,336 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 离线基准测试：用合成的数据和确定性的大模型、embeddings 替身（LLM_PROVIDER=fake）测量各个热点路径的吞吐量、
+# 延迟和内存峰值，不需要网络和数据库。每个场景在独立的子进程中运行，内存峰值互不影响
+
+SPECIALTIES = ["消化", "呼吸", "心血管", "神经", "内分泌", "肾脏", "血液", "风湿免疫", "感染", "老年医学"]
+SURGERIES = ["普通", "骨", "泌尿", "神经", "心胸", "血管", "整形", "肝胆", "乳腺", "甲状腺"]
+OTHER_DEPARTMENTS = ["儿科", "妇科", "产科", "眼科", "耳鼻喉科", "口腔科", "皮肤科", "急诊科", "康复医学科", "中医科"]
+
+ANOMALY_RULE = "文本长度小于 10"
+
+
+def make_workbooks(rows, cols, diff_density, seed):
+    # 生成两份表头不同的数据源：第一列为编号，其余列依次为整数、浮点数和文本，
+    # 文件2 中每个单元格按 diff_density 的概率被修改
+    rng = np.random.default_rng(seed)
+    data = {"编号": np.arange(rows)}
+    for i in range(1, cols):
+        if i % 3 == 1:
+            data[f"字段{i}"] = rng.integers(0, 10000, rows)
+        elif i % 3 == 2:
+            data[f"字段{i}"] = (rng.random(rows) * 1000).round(2)
+        else:
+            data[f"字段{i}"] = np.array([f"文本{value}" for value in rng.integers(0, rows, rows)], dtype=object)
+    df1 = pd.DataFrame(data)
+
+    df2 = df1.copy()
+    for column in df1.columns[1:]:
+        mask = rng.random(rows) < diff_density
+        df2.loc[mask, column] = df2.loc[mask, column] + ("改" if df2[column].dtype == object else 1)
+
+    mappings = [{"col1": column, "col2": f"{column}（新）"} for column in df1.columns]
+    df2 = df2.rename(columns={mapping["col1"]: mapping["col2"] for mapping in mappings})
+    return df1, df2, mappings
+
+
+def make_texts(rows, cols, seed):
+    # 异常值检测的文本列，约一半的文本重复出现，与实际数据中的重复比例相近
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({f"文本{i}": [f"样本{'长' * (value % 12)}{value}" for value in rng.integers(0, max(rows // 2, 1), rows)]
+                         for i in range(1, cols + 1)})
+
+
+def make_departments(rows, seed):
+    # 候选科室为标准科室名称，待匹配科室中三分之一可以精确匹配、三分之一带病区编号、其余需要交给大模型
+    rng = np.random.default_rng(seed)
+    candidates = ([f"{name}内科" for name in SPECIALTIES] + [f"{name}外科" for name in SURGERIES]
+                  + OTHER_DEPARTMENTS)
+    departments = []
+    for i, value in enumerate(rng.integers(0, len(candidates), rows)):
+        name = candidates[value]
+        level1 = "内科" if name.endswith("内科") else "外科" if name.endswith("外科") else "其他"
+        if i % 3 == 0:
+            departments.append((f"{name}门诊", level1, f"{name}的门诊"))
+        elif i % 3 == 1:
+            departments.append((f"{name}{i % 9 + 1}病区", level1, "nan"))
+        else:
+            departments.append((f"{SPECIALTIES[value % len(SPECIALTIES)]}特色诊疗中心{i}", "多学科联合门诊(MDT)",
+                                f"由{name}等科室医生组成"))
+    return departments, candidates
+
+
+def bench_apply_mappings(config):
+    from services.comparison import apply_mappings
+
+    _, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    return len(df2), lambda progress: apply_mappings(df2, mappings)
+
+
+def bench_highlight_differences(config):
+    from services.comparison import apply_mappings, highlight_differences
+
+    df1, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    df2_mapped = apply_mappings(df2, mappings)
+    return len(df1), lambda progress: highlight_differences(df1, df2_mapped, list(df1.columns))
+
+
+def bench_compare_by_keys(config):
+    from services.comparison import apply_mappings, compare_by_keys
+
+    df1, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    df2_mapped = apply_mappings(df2, mappings)
+    return len(df1), lambda progress: compare_by_keys(df1, df2_mapped, list(df1.columns), ["编号"])
+
+
+def bench_to_excel(config):
+    from services.comparison import apply_mappings, highlight_differences
+    from services.excel import to_excel_bytes
+
+    df1, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    df_all = highlight_differences(df1, apply_mappings(df2, mappings), list(df1.columns))
+    return len(df_all), lambda progress: to_excel_bytes(df_all)
+
+
+def bench_result_store_write(config):
+    import uuid
+    from services.comparison import apply_mappings, highlight_differences
+    from services.result_store import ResultStore
+
+    df1, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    df_all = highlight_differences(df1, apply_mappings(df2, mappings), list(df1.columns))
+    return len(df_all), lambda progress: ResultStore.write(
+        os.path.join(config["work_dir"], "results", uuid.uuid4().hex), df_all, list(df1.columns))
+
+
+def bench_result_store_page(config):
+    # 筛选某一列有差异的行，并依次读取前 20 页（每页 100 行）
+    from services.comparison import apply_mappings, highlight_differences
+    from services.result_store import ResultStore
+
+    df1, df2, mappings = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    df_all = highlight_differences(df1, apply_mappings(df2, mappings), list(df1.columns))
+    store = ResultStore.write(os.path.join(config["work_dir"], "results", "page"), df_all, list(df1.columns))
+    del df_all
+
+    def run(progress):
+        rows = ResultStore(store.directory).filter_rows(True, [df1.columns[-1]])
+        for page in range(20):
+            store.page(page * 100, 100, rows)
+
+    return 20 * 100, run
+
+
+def bench_read_table(config):
+    from services.excel import read_table, to_excel_bytes
+
+    df1, _, _ = make_workbooks(config["rows"], config["cols"], config["diff_density"], config["seed"])
+    path = os.path.join(config["work_dir"], "workbook.xlsx")
+    with open(path, "wb") as f:
+        f.write(to_excel_bytes(df1))
+    return len(df1), lambda progress: read_table(path)
+
+
+def _bench_anomalies(config, packed, compile_rules=False):
+    from services.anomaly import detect_anomalies_per_column
+
+    df = make_texts(config["llm_rows"], 2, config["seed"])
+    columns = list(df.columns)
+    rules = {column: ANOMALY_RULE for column in columns}
+    return len(df), lambda progress: detect_anomalies_per_column(df, columns, rules, packed=packed,
+                                                                   compile_rules=compile_rules, on_progress=progress)
+
+
+def bench_detect_anomalies(config):
+    return _bench_anomalies(config, packed=False)
+
+
+def bench_detect_anomalies_packed(config):
+    return _bench_anomalies(config, packed=True)
+
+
+def bench_detect_anomalies_compiled(config):
+    return _bench_anomalies(config, packed=True, compile_rules=True)
+
+
+def bench_match_departments(config):
+    from services.department_matching import match_departments
+
+    departments, candidates = make_departments(config["llm_rows"], config["seed"])
+    return len(departments), lambda progress: match_departments(departments, candidates, on_progress=progress)
+
+
+def bench_rag_retrieval(config):
+    from langchain_core.documents import Document
+
+    from services.department_matching import COLLECTION_NAME, retrieve_contexts
+    from services.fake_llm import FakeEmbeddings
+    from services.local_vector_index import LocalVectorIndex
+    from services.vector_search import local_index_path
+
+    departments, candidates = make_departments(config["llm_rows"], config["seed"])
+    # 参考文档库：每个候选科室若干条带简介的文档
+    documents = [Document(page_content=f"一级科室: {name[-2:]}\n二级科室: {name}\n简介: {name}第{i}类疾病")
+                 for name in candidates for i in range(10)]
+    LocalVectorIndex.from_documents(documents, FakeEmbeddings()).save(local_index_path(COLLECTION_NAME))
+    return len(departments), lambda progress: retrieve_contexts(departments)
+
+
+SCENARIOS = {
+    "read_table": bench_read_table,
+    "apply_mappings": bench_apply_mappings,
+    "highlight_differences": bench_highlight_differences,
+    "compare_by_keys": bench_compare_by_keys,
+    "to_excel": bench_to_excel,
+    "result_store_write": bench_result_store_write,
+    "result_store_page": bench_result_store_page,
+    "detect_anomalies": bench_detect_anomalies,
+    "detect_anomalies_packed": bench_detect_anomalies_packed,
+    "detect_anomalies_compiled": bench_detect_anomalies_compiled,
+    "match_departments": bench_match_departments,
+    "rag_retrieval": bench_rag_retrieval,
+}
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_scenario(name, config):
+    # 在子进程中执行：准备数据后重复运行 repeat 次。调用大模型的场景以每个请求从开始到完成的耗时作为延迟样本，
+    # 其余场景以每次运行的耗时作为样本
+    rows, run = SCENARIOS[name](config)
+    durations, latencies = [], []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(config["repeat"]):
+            start = time.perf_counter()
+            run(lambda completed, total: latencies.append(time.perf_counter() - start))
+            durations.append(time.perf_counter() - start)
+
+    samples = latencies or durations
+    seconds = float(np.median(durations))
+    return {
+        "scenario": name,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 2),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def check_regressions(results, baseline_path, max_regression):
+    # 与基准结果比较吞吐量，任何场景下降超过 max_regression 视为回归
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != results["config"]:
+        print("警告：基准结果使用的参数与本次不同，比较结果可能没有意义")
+
+    baseline_results = {result["scenario"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        previous = baseline_results.get(result["scenario"])
+        if previous and previous["rows_per_sec"] and result["rows_per_sec"] is not None:
+            change = result["rows_per_sec"] / previous["rows_per_sec"] - 1
+            print(f"{result['scenario']}: {previous['rows_per_sec']} -> {result['rows_per_sec']} 行/秒（{change:+.1%}）")
+            if change < -max_regression:
+                regressions.append(result["scenario"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试：使用合成数据和大模型替身测量各处理环节的性能")
+    parser.add_argument("--scenarios", nargs="*", choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="要运行的场景，默认全部")
+    parser.add_argument("--rows", type=int, default=10000, help="数据比较和导出场景的行数")
+    parser.add_argument("--cols", type=int, default=10, help="数据比较和导出场景的列数（含编号列）")
+    parser.add_argument("--diff-density", type=float, default=0.1, help="文件2 中被修改的单元格比例")
+    parser.add_argument("--llm-rows", type=int, default=500, help="调用大模型和检索的场景的行数")
+    parser.add_argument("--latency-ms", type=float, default=20, help="模拟的大模型请求延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="延迟的随机波动比例，0.5 表示最多增加 50%%")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟的大模型请求失败概率")
+    parser.add_argument("--embedding-latency-ms", type=float, default=5, help="模拟的 embeddings 请求延迟（毫秒）")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="最大并发请求数，默认使用 LLM_MAX_CONCURRENCY")
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景重复运行的次数，吞吐量取中位数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="把结果写入 JSON 文件，可以作为之后运行的 --baseline")
+    parser.add_argument("--baseline", help="之前保存的 JSON 结果，吞吐量下降超过 --max-regression 时以状态码 1 退出")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的吞吐量下降比例")
+    args = parser.parse_args()
+
+    config = {
+        "rows": args.rows,
+        "cols": args.cols,
+        "diff_density": args.diff_density,
+        "llm_rows": args.llm_rows,
+        "latency_ms": args.latency_ms,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "embedding_latency_ms": args.embedding_latency_ms,
+        "max_concurrency": args.max_concurrency,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 子进程继承这些环境变量：使用替身模型、关闭响应缓存，向量索引和指标写入临时目录
+        os.environ.update({
+            "LLM_PROVIDER": "fake",
+            "LLM_CACHE_ENABLED": "false",
+            "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+            "FAKE_LLM_JITTER": str(args.jitter),
+            "FAKE_LLM_ERROR_RATE": str(args.error_rate),
+            "FAKE_EMBEDDING_LATENCY_MS": str(args.embedding_latency_ms),
+            "VECTOR_STORE": "local",
+            "LOCAL_VECTOR_INDEX_DIR": os.path.join(work_dir, "vector_index"),
+            "EMBEDDING_CACHE_DIR": os.path.join(work_dir, "embeddings"),
+            "METRICS_PATH": os.path.join(work_dir, "metrics.sqlite3"),
+            "RESULT_STORE_DIR": os.path.join(work_dir, "results"),
+        })
+        if args.max_concurrency:
+            os.environ["LLM_MAX_CONCURRENCY"] = str(args.max_concurrency)
+
+        results = []
+        for name in args.scenarios:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(run_scenario, name, dict(config, work_dir=work_dir)).result()
+            results.append(result)
+            print(f"{name}: {result['rows_per_sec']} 行/秒，p50 {result['p50_ms']}ms，p99 {result['p99_ms']}ms，"
+                  f"内存峰值 {result['peak_rss_mb']}MB")
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+    output = {"config": config, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入文件: {args.output}")
+
+    if args.baseline:
+        regressions = check_regressions(output, args.baseline, args.max_regression)
+        if regressions:
+            print(f"吞吐量回归超过 {args.max_regression:.0%} 的场景: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,99 @@
-from langchain_community.document_loaders import PyPDFLoader
+import argparse
+import hashlib
+import os
+import sys
+import time
 
-# Load the document
-file_path = "../files/人保e相助_2024_4-41.pdf"
-loader = PyPDFLoader(file_path)
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-docs = loader.load()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.local_vector_index import DOCUMENTS_FILE, VECTORS_FILE, LocalVectorIndex
+from services.metrics import get_callbacks, metrics_scope
+from services.pdf import load_pdf_pages, pdf_digest
+from services.vector_search import get_cached_embeddings
 
-from langchain_openai import ChatOpenAI
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INDEX_DIR = os.path.join(ROOT_DIR, ".cache", "contract_index")
 
-llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0,
-)
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
 
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+def index_key(file_path, embedding_model, chunk_size, chunk_overlap):
+    # 索引按 PDF 内容以及切分、向量化参数区分，任意一个变化都会重新构建
+    pdf_hash = pdf_digest(file_path)
+    settings = hashlib.sha256(f"{embedding_model}\n{chunk_size}\n{chunk_overlap}".encode("utf-8")).hexdigest()
+    return f"{pdf_hash[:16]}-{settings[:12]}"
+
+
+def load_or_build_index(file_path, embeddings, index_dir):
+    index_path = os.path.join(index_dir, index_key(file_path, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP))
+    if all(os.path.exists(os.path.join(index_path, name)) for name in (VECTORS_FILE, DOCUMENTS_FILE)):
+        # 同一份合同的后续提问直接加载已持久化的索引，不再解析 PDF 和计算向量
+        return LocalVectorIndex.load(index_path, embeddings)
+
+    docs = load_pdf_pages(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    splits = text_splitter.split_documents(docs)
+    index = LocalVectorIndex.from_documents(splits, embeddings)
+    # save 先写入临时目录再整体改名，中途崩溃不会留下只保存了一半、之后每次都加载失败的索引
+    index.save(index_path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于合同 PDF 回答问题")
+    parser.add_argument("question", nargs="?", default="合同中 7.18 章节重大疾病的正文内容有哪些？")
+    parser.add_argument("--pdf", default=os.path.join(ROOT_DIR, "files", "人保e相助_2024_4-41.pdf"))
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="持久化向量索引的目录")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    embeddings = get_cached_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+    with metrics_scope("contract_qa"):
+        vectorstore = load_or_build_index(args.pdf, embeddings, args.index_dir)
+    print(f"索引准备耗时 {time.perf_counter() - start:.3f}s，共 {len(vectorstore)} 个片段")
+
+    llm = ChatOpenAI(
+        model="gpt-4o",
+        temperature=0,
+        callbacks=get_callbacks(),
+    )
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-splits = text_splitter.split_documents(docs)
-vectorstore = InMemoryVectorStore.from_documents(
-    documents=splits, embedding=OpenAIEmbeddings(model="text-embedding-3-small")
-)
+    retriever = vectorstore.as_retriever()
 
-retriever = vectorstore.as_retriever()
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
 
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
+    system_prompt = (
+        "You are an assistant for question-answering tasks. "
+        "Use the following pieces of retrieved context to answer "
+        "the question. If you don't know the answer, say that you "
+        "don't know."
+        "\n\n"
+        "{context}"
+    )
 
-system_prompt = (
-    "You are an assistant for question-answering tasks. "
-    "Use the following pieces of retrieved context to answer "
-    "the question. If you don't know the answer, say that you "
-    "don't know."
-    "\n\n"
-    "{context}"
-)
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "{input}"),
+        ]
+    )
 
+    question_answer_chain = create_stuff_documents_chain(llm, prompt)
+    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
 
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system_prompt),
-        ("human", "{input}"),
-    ]
-)
+    with metrics_scope("contract_qa"):
+        results = rag_chain.invoke({"input": args.question})
 
-question_answer_chain = create_stuff_documents_chain(llm, prompt)
-rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+    for doc in results['context']:
+        print("RAG 的上下文", doc.page_content)
+    print("回答", results['answer'])
 
-results = rag_chain.invoke({"input": "合同中 7.18 章节重大疾病的正文内容有哪些？"})
 
-for doc in results['context']:
-    print("RAG 的上下文", doc.page_content)
-print("回答", results['answer'])
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,194 @@
-from langchain_community.document_loaders import PyPDFLoader
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import unicodedata
 
-# Load the document
-file_path = "../files/人保e相助_2024_4-41.pdf"
-documents = PyPDFLoader(file_path).load()
-
-# 假设我们只需要处理重疾险的第 18 到 33 页
-relevant_pages = documents[17:33]  # 注意索引从 0 开始
-
-# 创建 LLM 实例
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0,
-)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.llm import invoke_concurrently
+from services.metrics import get_callbacks, metrics_scope
+from services.pdf import load_pdf_pages, pdf_digest, pdf_page_count
+
+FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "files")
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache",
+                                      "disease_extraction")
 
-from langchain.prompts import PromptTemplate
 # 定义提取疾病名称的 Prompt
-prompt = PromptTemplate(
-    input_variables=["chunk"],
-    template="从以下内容提取序号和疾病名称，序号在（）中，疾病名称紧随其后。请精准逐字提取，不要遗漏或者自我发挥。"
-             "举例："
-             "(1)恶性肿瘤——重度"
-             "(2)较重急性心肌梗死"
-             "内容："
-             "\n{chunk}\n\n"
-             "提取序号和疾病名称："
-)
-
-# 从文档中提取重疾险的内容
-from langchain_core.output_parsers import StrOutputParser
-# 创建 LLMChain 实例
-chain = prompt | llm | StrOutputParser()
+PROMPT_TEMPLATE = ("从以下内容提取序号和疾病名称，序号在（）中，疾病名称紧随其后。请精准逐字提取，不要遗漏或者自我发挥。"
+                   "举例："
+                   "(1)恶性肿瘤——重度"
+                   "(2)较重急性心肌梗死"
+                   "内容："
+                   "\n{chunk}\n\n"
+                   "提取序号和疾病名称：")
+
+DISEASE_LINE_PATTERN = re.compile(r"^\((\d+)\)(.+)$")
+
+
+def parse_page_ranges(spec, page_count):
+    # 把 “18-33,40” 这样从 1 开始、包含两端的页码范围转换为从 0 开始的页码列表
+    if not spec:
+        return list(range(page_count))
+    pages = []
+    for part in spec.split(","):
+        start, _, end = part.strip().partition("-")
+        start = int(start)
+        end = int(end) if end else start
+        if start < 1 or end < start:
+            raise ValueError(f"无效的页码范围: {part}")
+        pages.extend(range(start - 1, min(end, page_count)))
+    return list(dict.fromkeys(pages))
+
+
+def parse_target(target, default_pages):
+    # 输入格式为 “文件路径” 或 “文件路径:页码范围”
+    path, separator, pages = target.rpartition(":")
+    if separator and os.path.exists(path) and re.fullmatch(r"[\d,\- ]+", pages):
+        return path, pages
+    return target, default_pages
+
+
+def checkpoint_path(checkpoint_dir, pdf_hash, model, page):
+    # 断点文件按 PDF 内容、模型和提示词区分，任意一个变化都会重新提取
+    run_key = hashlib.sha256(f"{model}\n{PROMPT_TEMPLATE}".encode("utf-8")).hexdigest()[:12]
+    return os.path.join(checkpoint_dir, f"{pdf_hash[:16]}-{run_key}", f"{page + 1}.json")
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["response"]
+
+
+def write_checkpoint(path, response):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"response": response}, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def parse_disease_lines(text):
+    # 返回（序号，疾病名称）列表，全角括号和空白统一处理，无法识别序号的行序号为 None
+    diseases = []
+    for line in text.splitlines():
+        line = re.sub(r"\s+", "", unicodedata.normalize("NFKC", line))
+        if not line:
+            continue
+        match = DISEASE_LINE_PATTERN.match(line)
+        if match:
+            diseases.append((match.group(1), match.group(2)))
+        else:
+            diseases.append((None, line))
+    return diseases
+
+
+def merge_diseases(responses, key=lambda disease: disease):
+    # 按出现顺序合并多页的提取结果，相邻页面重复提取到的疾病只保留一次
+    merged, seen = [], set()
+    for response in responses:
+        for disease in parse_disease_lines(response):
+            if key(disease) not in seen:
+                seen.add(key(disease))
+                merged.append(disease)
+    return merged
+
+
+def format_diseases(diseases):
+    return "\n".join(f"({number}){name}" if number else name for number, name in diseases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从保险合同 PDF 中批量提取重大疾病名称")
+    parser.add_argument("pdfs", nargs="*", help="PDF 文件路径，可以用 “路径:18-33,40” 指定页码范围（从 1 开始）")
+    parser.add_argument("--pages", help="未单独指定页码范围的 PDF 使用的页码范围，默认处理全部页面")
+    parser.add_argument("--output-dir", default=FILES_DIR, help="每个 PDF 的提取结果输出目录")
+    parser.add_argument("--merged-output", help="所有 PDF 合并去重后的疾病名称输出文件")
+    parser.add_argument("--checkpoint-dir", default=DEFAULT_CHECKPOINT_DIR, help="逐页保存提取结果的断点目录")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="最大并发请求数，默认使用 LLM_MAX_CONCURRENCY")
+    args = parser.parse_args()
+
+    # 不指定 PDF 时沿用原来的默认任务：重疾险条款位于第 18 到 33 页
+    targets = args.pdfs or [os.path.join(FILES_DIR, "人保e相助_2024_4-41.pdf") + ":18-33"]
+
+    # 创建 LLM 实例
+    llm = ChatOpenAI(
+        model=args.model,
+        temperature=0,
+        callbacks=get_callbacks(),
+    )
+    prompt = PromptTemplate(input_variables=["chunk"], template=PROMPT_TEMPLATE)
+    chain = prompt | llm | StrOutputParser()
+
+    # 收集所有 PDF 中尚未提取的页面，已有断点的页面直接复用
+    page_specs = {}
+    for target in targets:
+        path, page_spec = parse_target(target, args.pages)
+        page_specs.setdefault(path, []).append(page_spec)
+
+    pdf_pages, pending_checkpoints, pending_inputs = [], [], []
+    for path, specs in page_specs.items():
+        pdf_hash = pdf_digest(path)
+        page_count = pdf_page_count(path, pdf_hash)
+        # 同一个 PDF 的多个页码范围合并处理，输出到同一个结果文件
+        pages = list(dict.fromkeys(page for spec in specs for page in parse_page_ranges(spec, page_count)))
+        checkpoints = [checkpoint_path(args.checkpoint_dir, pdf_hash, args.model, page) for page in pages]
+        pdf_pages.append((path, checkpoints))
+        # 只解析没有断点的页面
+        pending_pages = [page for page, checkpoint in zip(pages, checkpoints) if not os.path.exists(checkpoint)]
+        for document in load_pdf_pages(path, pending_pages):
+            pending_checkpoints.append(checkpoint_path(args.checkpoint_dir, pdf_hash, args.model,
+                                                       document.metadata["page"]))
+            pending_inputs.append({"chunk": document.page_content})
+        print(f"{path}: 共 {len(checkpoints)} 页，其中 {len(pages) - len(pending_pages)} 页已有断点")
+
+    # 所有 PDF 的待提取页面一起并发处理，每完成一页立即写入断点，中断后重新运行只会处理缺失的页面
+    failed = 0
+
+    def save_result(index, response):
+        nonlocal failed
+        if isinstance(response, Exception):
+            failed += 1
+            print(f"提取失败: {pending_checkpoints[index]}, {response}")
+        else:
+            write_checkpoint(pending_checkpoints[index], response)
+
+    def show_progress(completed, total):
+        print(f"已完成 {completed}/{total} 页")
+
+    with metrics_scope("extract_diseases"):
+        invoke_concurrently(chain, pending_inputs, max_concurrency=args.max_concurrency, on_progress=show_progress,
+                            on_result=save_result)
+
+    # 合并每个 PDF 各页的提取结果并去重后输出
+    os.makedirs(args.output_dir, exist_ok=True)
+    all_responses = []
+    for path, checkpoints in pdf_pages:
+        responses = [response for response in map(read_checkpoint, checkpoints) if response is not None]
+        all_responses.extend(responses)
+        output_file_path = os.path.join(args.output_dir,
+                                        f"{os.path.splitext(os.path.basename(path))[0]}_extracted_diseases.txt")
+        with open(output_file_path, "w", encoding="utf-8") as f:
+            f.write(format_diseases(merge_diseases(responses)))
+        print(f"提取的疾病名称已写入文件: {output_file_path}")
 
-# 处理每个页面并提取信息
-extracted_diseases = []
-for page in relevant_pages:
-    response = chain.invoke({"chunk": page.page_content})
-    extracted_diseases.append(response)
+    if args.merged_output:
+        # 不同合同的序号互不相关，跨文件只按疾病名称去重
+        with open(args.merged_output, "w", encoding="utf-8") as f:
+            f.write("\n".join(name for _, name in merge_diseases(all_responses, key=lambda disease: disease[1])))
+        print(f"合并去重后的疾病名称已写入文件: {args.merged_output}")
 
-# 合并结果
-final_disease_list = "\n".join(extracted_diseases)
+    if failed:
+        print(f"{failed} 页提取失败，重新运行脚本即可只处理这些页面")
+        sys.exit(1)
 
-# 输出结果到文件
-output_file_path = "../files/extracted_diseases.txt"
-with open(output_file_path, 'w', encoding='utf-8') as f:
-    f.write(final_disease_list)
 
-print(f"提取的疾病名称已写入文件: {output_file_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
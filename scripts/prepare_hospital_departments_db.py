@@ -1,30 +1,42 @@
 import os
+import sys
 from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_postgres.vectorstores import PGVector
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.local_vector_index import LocalVectorIndex
+from services.vector_search import VECTOR_STORE, get_cached_embeddings, get_vectorstore, local_index_path, sync_documents
 
+embedding_model = "text-embedding-3-small"
+embeddings = get_cached_embeddings(OpenAIEmbeddings(model=embedding_model), embedding_model)
+
+# 使用文件自带的表头（而不是指定 fieldnames），表头行不会被当作一条科室数据导入
 loader = CSVLoader(
-    file_path="../files/hospital_departments_full.csv",
+    file_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "files", "hospital_departments_full.csv"),
+    encoding="utf-8-sig",
     csv_args={
             "delimiter": ",",
-            "fieldnames": ["一级科室", "二级科室", "科室简介"],
         },
     )
 docs = loader.load()
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 splits = text_splitter.split_documents(docs)
 
-connection = os.getenv("DATABASE_URL")
 collection_name = "hospital_departments"
-vectorstore = PGVector(
-    embeddings=embeddings,
-    collection_name=collection_name,
-    connection=connection,
-    use_jsonb=True,
-)
 
-vectorstore.add_documents(splits)
+if VECTOR_STORE == "local":
+    # 本地模式：把向量写入内存映射的索引文件，页面通过 VECTOR_STORE=local 直接加载，无需数据库
+    index_path = local_index_path(collection_name)
+    if os.path.exists(index_path):
+        vectorstore = LocalVectorIndex.load(index_path, embeddings)
+    else:
+        vectorstore = LocalVectorIndex.empty(embeddings)
+else:
+    vectorstore = get_vectorstore(collection_name, embeddings)
 
+# 增量导入：只为新增或内容变化的科室计算向量，并删除已不存在的旧数据
+added, deleted = sync_documents(vectorstore, collection_name, splits)
+if VECTOR_STORE == "local":
+    vectorstore.save(index_path)
+print(f"新增 {added} 条，删除 {deleted} 条，共 {len(splits)} 条科室数据")
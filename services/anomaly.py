@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage
+
+from services.excel import read_table, to_excel_bytes
+from services.llm import get_llm_model, invoke_concurrently, get_context_window, estimate_tokens
+from services.rule_compiler import build_compile_messages, evaluate_spec, parse_rule_spec
+
+CHECK_FAILED = "检测失败"
+RESULT_SUFFIX = "_检测结果"
+RESULT_FILE = "result.xlsx"
+
+# 规则编译：每条编译成功的规则抽样若干条文本交给大模型逐条检测，与编译结果的一致率达到要求才使用编译结果
+RULE_VALIDATION_SAMPLE_SIZE = int(os.environ.get("RULE_VALIDATION_SAMPLE_SIZE") or 20)
+RULE_MIN_AGREEMENT = float(os.environ.get("RULE_MIN_AGREEMENT") or 0.9)
+
+logger = logging.getLogger(__name__)
+
+
+def build_rule_messages(rule, text):
+    return [
+        AIMessage(content=f"""
+你是一名数据分析助手。
+请根据以下检测规则，判断给定的文本是否**符合**规则。
+
+- 如果文本符合检测规则，请回答“是”；
+- 如果文本不符合检测规则，请回答“否”。
+
+请仅回答“是”或“否”，不需要任何解释。
+
+**示例 1**：
+- 检测规则：文本长度小于 10
+- 文本：hello
+- 回答：是
+
+**示例 2**：
+- 检测规则：包含英文
+- 文本：你好
+- 回答：否
+"""),
+        HumanMessage(content=f"""
+检测规则：{rule} 
+文本：{text}
+回答：
+""")
+    ]
+
+
+PACKED_RULE_PROMPT = """
+你是一名数据分析助手。
+请根据以下检测规则，逐条判断文本列表中的每一条文本是否**符合**规则。
+
+- 如果文本符合检测规则，该条回答“是”；
+- 如果文本不符合检测规则，该条回答“否”。
+
+请仅输出一个 JSON 数组，数组长度与文本数量相同，按编号顺序依次为每条文本的回答，不需要任何解释。
+
+**示例**：
+- 检测规则：文本长度小于 10
+- 文本列表：
+1. "hello"
+2. "hello world, hello"
+- 回答：["是", "否"]
+"""
+
+# 每次请求最多打包的行数，以及每行除文本本身外的 token 开销（编号、引号和回答）
+MAX_PACK_SIZE = 20
+PACKED_ROW_OVERHEAD_TOKENS = 8
+
+
+def build_packed_rule_messages(rule, texts):
+    numbered_texts = "\n".join(f"{i}. {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts, start=1))
+    return [
+        AIMessage(content=PACKED_RULE_PROMPT),
+        HumanMessage(content=f"""
+检测规则：{rule}
+文本列表：
+{numbered_texts}
+回答：
+""")
+    ]
+
+
+def parse_packed_verdicts(content, count):
+    # 返回与文本一一对应的结论，无法解析的位置为 None
+    start, end = content.find("["), content.rfind("]")
+    if start == -1 or end < start:
+        return [None] * count
+    try:
+        verdicts = json.loads(content[start:end + 1])
+    except ValueError:
+        return [None] * count
+    if not isinstance(verdicts, list) or len(verdicts) != count:
+        return [None] * count
+    return [verdict.strip() if isinstance(verdict, str) and verdict.strip() in ("是", "否") else None
+            for verdict in verdicts]
+
+
+def pack_rows(texts, rule, model):
+    # 根据模型的上下文窗口贪心地把多行打包进一次请求，预留一半窗口给输出和估算误差
+    budget = get_context_window(model) // 2 - estimate_tokens(PACKED_RULE_PROMPT + rule)
+    packs, current, used = [], [], 0
+    for index, text in enumerate(texts):
+        cost = estimate_tokens(json.dumps(text, ensure_ascii=False)) + PACKED_ROW_OVERHEAD_TOKENS
+        if current and (len(current) >= MAX_PACK_SIZE or used + cost > budget):
+            packs.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def dedupe_checks(df, selected_columns, detection_rules):
+    # 同一规则下相同的文本只需要检测一次，返回去重后的（规则，文本）列表以及每一行对应的检测序号
+    checks, slots, row_slots = [], {}, {}
+    for column in selected_columns:
+        rule = detection_rules.get(column, "")
+        codes, uniques = pd.factorize(df[column].astype(str))
+        column_slots = np.empty(len(uniques), dtype=np.intp)
+        for i, text in enumerate(uniques):
+            key = (rule, text)
+            if key not in slots:
+                slots[key] = len(checks)
+                checks.append(key)
+            column_slots[i] = slots[key]
+        row_slots[column] = column_slots[codes]
+    return checks, row_slots
+
+
+def detect_checks(checks, slots=None, packed=False, on_progress=None, on_result=None):
+    # 检测去重后的（规则，文本）列表中的指定序号（默认全部），每得到一条结论就调用 on_result(slot, verdict)，
+    # 返回 {序号: 结论}
+    model = get_llm_model()
+    verdicts = {}
+
+    def save(slot, verdict):
+        verdicts[slot] = verdict
+        if on_result is not None:
+            on_result(slot, verdict)
+
+    pending = list(range(len(checks))) if slots is None else list(slots)
+
+    if packed:
+        # 同一规则的文本打包成一次请求，解析失败的文本再逐条检测
+        checks_by_rule = {}
+        for slot in pending:
+            checks_by_rule.setdefault(checks[slot][0], []).append(slot)
+        packs = [[rule_slots[i] for i in indices] for rule, rule_slots in checks_by_rule.items()
+                 for indices in pack_rows([checks[slot][1] for slot in rule_slots], rule, model)]
+        responses = invoke_concurrently(model, [
+            build_packed_rule_messages(checks[pack[0]][0], [checks[slot][1] for slot in pack]) for pack in packs
+        ], on_progress=on_progress)
+
+        pending = []
+        for pack, resp in zip(packs, responses):
+            if isinstance(resp, Exception):
+                pack_verdicts = [None] * len(pack)
+            else:
+                pack_verdicts = parse_packed_verdicts(resp.content, len(pack))
+            for slot, verdict in zip(pack, pack_verdicts):
+                if verdict is None:
+                    pending.append(slot)
+                else:
+                    save(slot, verdict)
+        logger.info(f"打包检测：{len(packs)} 次请求，{len(pending)} 条文本需要逐条检测")
+
+    # 所有待检测的文本一起并发检测
+    def handle_result(position, resp):
+        slot = pending[position]
+        text = checks[slot][1]
+        if isinstance(resp, Exception):
+            result = CHECK_FAILED
+            logger.warning("文本: %s，检测失败: %s", text, resp)
+        else:
+            result = resp.content
+            # 逐条结果只在 DEBUG 级别输出，调用量统计见监控页面
+            logger.debug("文本: %s，检测结果: %s", text, result)
+        save(slot, result)
+
+    invoke_concurrently(model, [build_rule_messages(*checks[slot]) for slot in pending], on_progress=on_progress,
+                        on_result=handle_result)
+    return verdicts
+
+
+def compile_rule_specs(rules):
+    # 每条规则调用一次大模型，返回 {规则: 表达式}，无法编译的规则为 None
+    model = get_llm_model()
+    responses = invoke_concurrently(model, [build_compile_messages(rule) for rule in rules])
+    return {rule: None if isinstance(resp, Exception) else parse_rule_spec(resp.content)
+            for rule, resp in zip(rules, responses)}
+
+
+def _validation_sample(predicted, size):
+    # 在编译结果为“是”和“否”的文本中各均匀抽取一半，两类都能得到验证
+    groups = [np.flatnonzero(predicted), np.flatnonzero(~predicted)]
+    quotas = [min(len(groups[0]), size // 2), min(len(groups[1]), size - size // 2)]
+    # 某一类数量不足时由另一类补齐
+    quotas[0] = min(len(groups[0]), size - quotas[1])
+    sample = []
+    for group, quota in zip(groups, quotas):
+        if quota:
+            sample.extend(group[np.linspace(0, len(group) - 1, quota).round().astype(int)])
+    return sorted(set(sample))
+
+
+def compile_checks(checks, slots=None, packed=False):
+    # 把可以编译的规则在整列文本上向量化地计算，返回（{序号: 结论}，仍需大模型逐条检测的序号，{规则: 表达式}）；
+    # 文本数量不超过抽样数量的规则编译没有收益，直接逐条检测
+    pending = list(range(len(checks))) if slots is None else list(slots)
+    slots_by_rule = {}
+    for slot in pending:
+        slots_by_rule.setdefault(checks[slot][0], []).append(slot)
+    rules = [rule for rule, rule_slots in slots_by_rule.items() if len(rule_slots) > RULE_VALIDATION_SAMPLE_SIZE]
+
+    specs = {rule: spec for rule, spec in compile_rule_specs(rules).items() if spec is not None}
+    predictions, samples = {}, {}
+    for rule, spec in list(specs.items()):
+        texts = pd.Series([checks[slot][1] for slot in slots_by_rule[rule]], dtype=object)
+        try:
+            predictions[rule] = evaluate_spec(spec, texts)
+        except TimeoutError:
+            # 正则在这批文本上回溯过多，放弃编译，交给大模型逐条检测
+            logger.warning(f"规则 {rule!r} 的表达式计算超时，改为由大模型检测")
+            del specs[rule]
+            continue
+        samples[rule] = [slots_by_rule[rule][position]
+                         for position in _validation_sample(predictions[rule], RULE_VALIDATION_SAMPLE_SIZE)]
+
+    sampled = detect_checks(checks, [slot for rule_samples in samples.values() for slot in rule_samples],
+                            packed=packed)
+
+    verdicts, compiled = {}, {}
+    for rule, rule_samples in samples.items():
+        predicted = dict(zip(slots_by_rule[rule], predictions[rule]))
+        answered = [slot for slot in rule_samples if sampled[slot].strip() in ("是", "否")]
+        agreed = sum((sampled[slot].strip() == "是") == predicted[slot] for slot in answered)
+        logger.info(f"规则 {rule!r} 编译为 {json.dumps(specs[rule], ensure_ascii=False)}，"
+                    f"抽样一致 {agreed}/{len(answered)}")
+        if len(answered) * 2 >= len(rule_samples) and agreed >= RULE_MIN_AGREEMENT * len(answered):
+            compiled[rule] = specs[rule]
+            verdicts.update((slot, "是" if value else "否") for slot, value in predicted.items())
+        else:
+            # 编译结果与大模型不一致，放弃编译；已经抽样检测的文本直接使用大模型的结论
+            verdicts.update((slot, sampled[slot]) for slot in rule_samples)
+
+    remaining = [slot for slot in pending if slot not in verdicts]
+    return verdicts, remaining, compiled
+
+
+def expand_verdicts(verdicts, row_slots, selected_columns):
+    # 把去重后的检测结果按行还原到每一列
+    verdicts = np.array(verdicts, dtype=object)
+    return {column: verdicts[row_slots[column]].tolist() for column in selected_columns}
+
+
+def detect_anomalies_per_column(df, selected_columns, detection_rules, packed=False, compile_rules=False,
+                                on_progress=None):
+    checks, row_slots = dedupe_checks(df, selected_columns, detection_rules)
+    verdicts, remaining = {}, None
+    if compile_rules:
+        verdicts, remaining, _ = compile_checks(checks, packed=packed)
+    verdicts.update(detect_checks(checks, remaining, packed=packed, on_progress=on_progress))
+    return expand_verdicts([verdicts[slot] for slot in range(len(checks))], row_slots, selected_columns)
+
+
+def add_result_columns(df, selected_columns, results):
+    for column in selected_columns:
+        df[f"{column}{RESULT_SUFFIX}"] = results[column]
+    return df
+
+
+def run_anomaly_job(job):
+    # 后台任务：逐条保存去重后每条文本的检测结论，任务中断后重新执行时只检测尚未保存的文本
+    df = read_table(job.file(job.params["input"]))
+    selected_columns = job.params["columns"]
+    detection_rules = dict(job.params["rules"])
+    checks, row_slots = dedupe_checks(df, selected_columns, detection_rules)
+    job.set_total(len(checks))
+
+    pending = [slot for slot in range(len(checks)) if slot not in job.results]
+    if job.params.get("compile_rules"):
+        verdicts, pending, compiled = compile_checks(checks, pending, packed=job.params["packed"])
+        job.save_results(verdicts)
+        # 恢复任务时之前编译的规则已经全部完成，不会再次编译，汇总信息需要保留
+        job.set_summary({"compiled_rules": {**job.summary.get("compiled_rules", {}), **compiled}})
+    detect_checks(checks, pending, packed=job.params["packed"], on_result=job.save_result)
+
+    verdicts = [job.results[slot] for slot in range(len(checks))]
+    add_result_columns(df, selected_columns, expand_verdicts(verdicts, row_slots, selected_columns))
+    with open(job.file(RESULT_FILE), "wb") as f:
+        f.write(to_excel_bytes(df))
@@ -0,0 +1,205 @@
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from services.cache import LRUCache
+
+DIFF_SUFFIX = "_差异"
+DIFF_FLAG_COLUMN = "是否有差异"
+HAS_DIFF = "有差异"
+NO_DIFF = "无差异"
+
+DIFF_TYPE_COLUMN = "差异类型"
+ADDED = "新增"
+REMOVED = "删除"
+MODIFIED = "修改"
+UNCHANGED = "无变化"
+
+# 比较结果的导出文件按（文件哈希、列映射、关键列）缓存，重复下载不再重新生成
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_MB") or 512) * 1024 * 1024
+result_cache = LRUCache(max_bytes=RESULT_CACHE_MAX_BYTES)
+
+
+def _column_equal(s1: pd.Series, s2: pd.Series) -> np.ndarray:
+    # 类型不一致（如 int 与 str）或者包含扩展类型时统一转为 object，逐元素比较
+    if s1.dtype != s2.dtype or not isinstance(s1.dtype, np.dtype):
+        a = s1.to_numpy(dtype=object)
+        b = s2.to_numpy(dtype=object)
+    else:
+        a = s1.to_numpy()
+        b = s2.to_numpy()
+
+    # 先计算缺失值掩码，只比较两边都不缺失的位置：pd.NA 参与比较的结果仍是 pd.NA，无法转为 bool
+    a_na = pd.isna(a)
+    b_na = pd.isna(b)
+    valid = ~(a_na | b_na)
+    equal = np.zeros(len(a), dtype=bool)
+    equal[valid] = np.asarray(a[valid] == b[valid], dtype=bool)
+    # NaN 与 NaN 视为相等
+    return equal | (a_na & b_na)
+
+
+def _format_differences(s1: pd.Series, s2: pd.Series, mask: np.ndarray) -> np.ndarray:
+    # 只对存在差异的单元格生成 “旧值 --> 新值” 文本
+    diff = np.full(len(s1), "", dtype=object)
+    if mask.any():
+        left = s1.to_numpy(dtype=object)[mask]
+        right = s2.to_numpy(dtype=object)[mask]
+        diff[mask] = [f"{a} --> {b}" for a, b in zip(left, right)]
+    return diff
+
+
+def apply_mappings(df2: pd.DataFrame, mappings: List[Dict[str, str]]) -> pd.DataFrame:
+    # 将 df2 的列名按照映射关系重命名为 df1 的列名
+    mapping_dict = {mapping['col2']: mapping['col1'] for mapping in mappings}
+    df2_mapped = df2.rename(columns=mapping_dict)
+    # 只保留映射后的列
+    df2_mapped = df2_mapped[list(mapping_dict.values())]
+    return df2_mapped
+
+
+def _pad_rows(df: pd.DataFrame, rows: int) -> pd.DataFrame:
+    # 补齐行数时先转为 object，整数列不会因为补入的空值变成浮点数，差异文本中仍显示原值
+    if len(df) >= rows:
+        return df
+    return df.astype(object).reindex(pd.RangeIndex(rows))
+
+
+def highlight_differences(df1: pd.DataFrame, df2_mapped: pd.DataFrame, mapped_columns: List[str]) -> pd.DataFrame:
+    # df1: 原始的 df1 数据框，包含所有列
+    # df2_mapped: 根据映射关系重命名后的 df2 数据框，只包含映射后的列
+    # mapped_columns: 映射后的列名列表（来自 df1）
+
+    # 重置索引以确保按行号对齐，行数不足的一侧以空值补齐
+    df1 = df1.reset_index(drop=True)
+    df2_mapped = df2_mapped.reset_index(drop=True)
+    if len(df2_mapped) > len(df1):
+        left = _pad_rows(df1[list(dict.fromkeys(mapped_columns))], len(df2_mapped))
+    else:
+        left = df1
+    right = _pad_rows(df2_mapped, len(left))
+
+    diff_columns = {}
+    row_has_diff = np.zeros(len(left), dtype=bool)
+
+    # 按列批量比较，避免逐个单元格读写
+    for column in mapped_columns:
+        s1 = left[column]
+        s2 = right[column]
+        mask = ~_column_equal(s1, s2)
+        diff_columns[f"{column}{DIFF_SUFFIX}"] = _format_differences(s1, s2, mask)
+        row_has_diff |= mask
+
+    diff_columns[DIFF_FLAG_COLUMN] = np.where(row_has_diff, HAS_DIFF, NO_DIFF).astype(object)
+
+    # 文件2多出的行按文件1的列排列后追加在末尾，差异列显示为从空值新增
+    if len(df2_mapped) > len(df1):
+        df_all = pd.concat([df1, df2_mapped.iloc[len(df1):].reindex(columns=df1.columns)], ignore_index=True)
+    else:
+        df_all = df1.copy()
+    # 将差异结果一次性添加到 df_all 中
+    df_all[list(diff_columns)] = pd.DataFrame(diff_columns, index=df_all.index)
+
+    return df_all
+
+
+def _key_value_text(value) -> str:
+    if isinstance(value, (float, np.floating)) and np.isfinite(value) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _key_text(s: pd.Series) -> pd.Series:
+    # 关键列转为文本时，整数值的浮点数（如包含空单元格的 Excel 整数列中的 1.0）写成整数文本 “1”，
+    # 与另一侧文本类型的 “1” 能够匹配；空值统一写成 “nan”
+    missing = s.isna().to_numpy()
+    if pd.api.types.is_float_dtype(s.dtype):
+        values = s.to_numpy(dtype="float64", na_value=np.nan)
+        text = s.astype(str).to_numpy(dtype=object)
+        integral = ~missing & np.isfinite(values) & (values == np.round(values)) & (np.abs(values) < 2 ** 53)
+        text[integral] = values[integral].astype(np.int64).astype(str)
+    else:
+        text = np.array([_key_value_text(value) for value in s.to_numpy(dtype=object)], dtype=object)
+    text[missing] = "nan"
+    return pd.Series(text, index=s.index, dtype=object)
+
+
+def _join_key_frame(df: pd.DataFrame, other: pd.DataFrame, key_columns: List[str]) -> pd.DataFrame:
+    keys = {}
+    for i, column in enumerate(key_columns):
+        s = df[column]
+        other_dtype = other[column].dtype
+        if s.dtype != other_dtype:
+            # 两侧类型不一致时统一成可比较的类型，避免 merge 报错或漏匹配
+            if pd.api.types.is_numeric_dtype(s.dtype) and pd.api.types.is_numeric_dtype(other_dtype):
+                s = s.astype("float64")
+            else:
+                s = _key_text(s)
+        keys[f"__key_{i}"] = s.to_numpy()
+    key_frame = pd.DataFrame(keys)
+    # 关键列重复时按出现顺序一一对应，保证连接结果是一对一的
+    key_frame["__occurrence"] = key_frame.groupby(list(keys), dropna=False, sort=False).cumcount()
+    return key_frame
+
+
+def _with_empty_differences(df: pd.DataFrame, mapped_columns: List[str]) -> pd.DataFrame:
+    df = df.copy()
+    empty = {f"{column}{DIFF_SUFFIX}": "" for column in mapped_columns}
+    df[list(empty)] = pd.DataFrame(empty, index=df.index)
+    df[DIFF_FLAG_COLUMN] = HAS_DIFF
+    return df
+
+
+def compare_by_keys(df1: pd.DataFrame, df2_mapped: pd.DataFrame, mapped_columns: List[str],
+                    key_columns: List[str]) -> pd.DataFrame:
+    # 按关键列做哈希连接，而不是按行号对齐，插入或删除一行不会影响其余行的比较
+    missing_keys = [column for column in key_columns if column not in mapped_columns]
+    if missing_keys:
+        raise ValueError(f"关键列必须是参与比较的列：{', '.join(missing_keys)}")
+
+    left = df1.reset_index(drop=True)
+    right = df2_mapped.reset_index(drop=True)
+
+    left_keys = _join_key_frame(left, right, key_columns)
+    right_keys = _join_key_frame(right, left, key_columns)
+    left_keys["__left_row"] = np.arange(len(left))
+    right_keys["__right_row"] = np.arange(len(right))
+
+    join_columns = [column for column in left_keys.columns if column != "__left_row"]
+    matched = left_keys.merge(right_keys, on=join_columns, how="inner", validate="one_to_one")
+    left_rows = matched["__left_row"].to_numpy()
+    right_rows = matched["__right_row"].to_numpy()
+
+    # 两侧都存在的行：逐列比较差异
+    common = highlight_differences(left.iloc[left_rows], right.iloc[right_rows], mapped_columns)
+    common.index = left_rows
+    # 关键列已经按归一化后的值匹配，不再视为差异
+    common[[f"{column}{DIFF_SUFFIX}" for column in key_columns]] = ""
+    diff_columns = [f"{column}{DIFF_SUFFIX}" for column in mapped_columns]
+    common[DIFF_FLAG_COLUMN] = np.where((common[diff_columns] != "").any(axis=1), HAS_DIFF, NO_DIFF)
+    common[DIFF_TYPE_COLUMN] = np.where(common[DIFF_FLAG_COLUMN] == HAS_DIFF, MODIFIED, UNCHANGED)
+
+    # 仅存在于文件1的行
+    removed_rows = np.setdiff1d(np.arange(len(left)), left_rows)
+    removed = _with_empty_differences(left.iloc[removed_rows], mapped_columns)
+    removed[DIFF_TYPE_COLUMN] = REMOVED
+
+    # 仅存在于文件2的行，按文件1的列排列后追加在末尾
+    added_rows = np.setdiff1d(np.arange(len(right)), right_rows)
+    added = _with_empty_differences(right.iloc[added_rows].reindex(columns=left.columns), mapped_columns)
+    added[DIFF_TYPE_COLUMN] = ADDED
+
+    df_all = pd.concat([common, removed]).sort_index()
+    df_all = pd.concat([df_all, added], ignore_index=True)
+
+    return df_all
+
+
+def compare_dataframes(df1: pd.DataFrame, df2_mapped: pd.DataFrame, mapped_columns: List[str],
+                       key_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    if key_columns:
+        return compare_by_keys(df1, df2_mapped, mapped_columns, key_columns)
+    return highlight_differences(df1, df2_mapped, mapped_columns)
+
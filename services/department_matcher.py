@@ -0,0 +1,177 @@
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+EXACT_MATCH = "精确匹配"
+FUZZY_MATCH = "模糊匹配"
+LLM_MATCH = "大模型匹配"
+
+# 科室名称中常见的、不影响所属标准科室的后缀，按长度从长到短去除
+DEPARTMENT_SUFFIXES = ("专家门诊", "普通门诊", "门诊部", "门诊", "病房", "病区", "诊室")
+
+# 括号中的备注，以及其中表示院区、楼栋、病区的部分（如“（东院区）”、“(3号楼)”、“【二病区】”）
+BRACKET_PATTERN = re.compile(r"[(\[【](.*?)[)\]】]")
+CAMPUS_NOTE_PATTERN = re.compile(r"^[0-9a-z一二三四五六七八九十东西南北中新老总本分号第]*(院区|分院|总院|本部|院|楼|层|病区|区)$")
+
+# 科室名称后面表示病区、院区或编号的部分
+WARD_NUMBER_PATTERN = re.compile(r"^[0-9一二三四五六七八九十东西南北总分院区组号楼层]+$")
+
+# 模糊匹配的置信阈值：最高分不低于 FUZZY_THRESHOLD，且领先第二名至少 FUZZY_MARGIN
+FUZZY_THRESHOLD = 0.85
+FUZZY_MARGIN = 0.1
+
+# 交给大模型的候选科室数量上限，提示词长度不再随标准科室列表的长度增长
+SHORTLIST_SIZE = int(os.environ.get("DEPARTMENT_SHORTLIST_SIZE") or 20)
+
+# 一级科室、简介等上下文中出现候选科室名称片段时的加分权重
+CONTEXT_WEIGHT = 0.5
+
+
+def _bracket_remarks(name: str) -> List[str]:
+    return BRACKET_PATTERN.findall(unicodedata.normalize("NFKC", str(name)).lower())
+
+
+def has_specialty_remark(name: str) -> bool:
+    # 括号中除院区、楼栋、病区以外的备注（如“妇科（计划生育）”、“心内科(CCU)”）可能指向更细的专科，不能直接忽略
+    return any(not CAMPUS_NOTE_PATTERN.search(remark.strip()) for remark in _bracket_remarks(name))
+
+
+def normalize_department_name(name: str) -> str:
+    # 全角转半角、去掉括号内的院区、楼栋、病区等备注，其他括号只去掉括号本身、保留备注文字，
+    # 再去掉标点空白以及常见后缀
+    name = unicodedata.normalize("NFKC", str(name)).lower()
+    name = BRACKET_PATTERN.sub(lambda m: "" if CAMPUS_NOTE_PATTERN.search(m.group(1).strip()) else m.group(1), name)
+    name = re.sub(r"[\s\W_]+", "", name)
+    for suffix in DEPARTMENT_SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name
+
+
+def _bigrams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _edit_similarity(a: str, b: str) -> float:
+    if not a and not b:
+        return 1.0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return 1 - previous[-1] / max(len(a), len(b))
+
+
+class DepartmentMatcher:
+    # 在调用大模型之前，先用名称归一化后的哈希索引和字符 bigram / 编辑距离打分做本地匹配
+
+    def __init__(self, candidate_departments: Sequence[str]):
+        self.candidates = list(candidate_departments)
+        self._normalized = [normalize_department_name(candidate) for candidate in self.candidates]
+        self._by_name: Dict[str, List[int]] = defaultdict(list)
+        self._by_bigram: Dict[str, List[int]] = defaultdict(list)
+        self._bigrams = []
+        for index, name in enumerate(self._normalized):
+            self._by_name[name].append(index)
+            bigrams = _bigrams(name)
+            self._bigrams.append(bigrams)
+            for bigram in bigrams:
+                self._by_bigram[bigram].append(index)
+        self._idf = {bigram: math.log((1 + len(self.candidates)) / (1 + len(indices)))
+                     for bigram, indices in self._by_bigram.items()}
+        # 单字集合用于给没有共享 bigram 的候选排序
+        self._chars = [set(name) for name in self._normalized]
+        char_counts: Dict[str, int] = defaultdict(int)
+        for chars in self._chars:
+            for char in chars:
+                char_counts[char] += 1
+        self._char_idf = {char: math.log((1 + len(self.candidates)) / (1 + count))
+                          for char, count in char_counts.items()}
+
+    def _shared_bigrams(self, bigrams: Set[str]) -> Dict[int, int]:
+        shared: Dict[int, int] = defaultdict(int)
+        for bigram in bigrams:
+            for index in self._by_bigram.get(bigram, ()):
+                shared[index] += 1
+        return shared
+
+    def _name_scores(self, name: str) -> Dict[int, float]:
+        # 只对至少共享一个 bigram 的候选打分
+        normalized = normalize_department_name(name)
+        bigrams = _bigrams(normalized)
+        scores = {}
+        for index, count in self._shared_bigrams(bigrams).items():
+            dice = 2 * count / (len(bigrams) + len(self._bigrams[index]))
+            scores[index] = (dice + _edit_similarity(normalized, self._normalized[index])) / 2
+        return scores
+
+    def score(self, name: str) -> List[Tuple[float, str]]:
+        # 返回按得分从高到低排列的（得分，候选科室）
+        scores = [(score, self.candidates[index]) for index, score in self._name_scores(name).items()]
+        scores.sort(key=lambda item: item[0], reverse=True)
+        return scores
+
+    def shortlist(self, name: str, context: str = "", k: int = SHORTLIST_SIZE) -> List[str]:
+        # 按名称相似度以及候选科室名称在上下文（一级科室、简介）中的出现程度，挑选最相关的 k 个候选科室
+        if len(self.candidates) <= k:
+            return list(self.candidates)
+        scores = self._name_scores(name)
+        context_bigrams = _bigrams(re.sub(r"[\s\W_]+", "", unicodedata.normalize("NFKC", str(context)).lower()))
+        # 按 IDF 加权，“内科”、“外科”这类几乎所有候选都有的片段不加分
+        for index, bigrams in enumerate(self._bigrams):
+            total = sum(self._idf[bigram] for bigram in bigrams)
+            shared = sum(self._idf[bigram] for bigram in bigrams & context_bigrams)
+            if shared > 0:
+                scores[index] = scores.get(index, 0.0) + CONTEXT_WEIGHT * shared / total
+        # 总是返回 k 个候选：共享 bigram 的候选不足 k 个时，其余名额按 IDF 加权的共享单字比例补足，
+        # 仍然相同时按候选列表的顺序，提示词长度不随候选列表增长，也不会只剩下一两个候选
+        chars = set(normalize_department_name(name))
+        char_scores = [sum(self._char_idf[char] for char in candidate_chars & chars)
+                       / (sum(self._char_idf[char] for char in candidate_chars) or 1.0)
+                       for candidate_chars in self._chars]
+        top = sorted(range(len(self.candidates)),
+                     key=lambda index: (-scores.get(index, 0.0), -char_scores[index], index))[:k]
+        return [self.candidates[index] for index in top]
+
+    def match(self, name: str) -> Tuple[Optional[str], str]:
+        # 带有专科备注的名称交给大模型结合候选列表判断
+        if has_specialty_remark(name):
+            return None, LLM_MATCH
+        normalized = normalize_department_name(name)
+        exact = self._by_name.get(normalized, [])
+        if len(exact) == 1:
+            return self.candidates[exact[0]], EXACT_MATCH
+
+        # 名称由候选科室加上病区、院区等编号组成（如“泌尿外科二病区”、“心内科3”）
+        for length in range(len(normalized) - 1, 1, -1):
+            prefix = self._by_name.get(normalized[:length], [])
+            if prefix:
+                if len(prefix) == 1 and WARD_NUMBER_PATTERN.match(normalized[length:]):
+                    return self.candidates[prefix[0]], FUZZY_MATCH
+                break
+
+        scores = self.score(name)
+        if scores and scores[0][0] >= FUZZY_THRESHOLD:
+            runner_up = scores[1][0] if len(scores) > 1 else 0.0
+            if scores[0][0] - runner_up >= FUZZY_MARGIN:
+                return scores[0][1], FUZZY_MATCH
+        return None, LLM_MATCH
+
+
+def prematch_departments(department_names: Sequence[str],
+                         matcher: DepartmentMatcher) -> Tuple[List[Optional[str]], List[str]]:
+    # 返回每一行的本地匹配结果（无法确定时为 None，需要交给大模型）以及所属的匹配层级
+    matches, tiers = [], []
+    for name in department_names:
+        match, tier = matcher.match(name)
+        matches.append(match)
+        tiers.append(tier)
+    return matches, tiers
@@ -0,0 +1,191 @@
+import logging
+from collections import Counter
+
+import pandas as pd
+from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from services.department_matcher import DepartmentMatcher, prematch_departments
+from services.excel import read_table, to_excel_bytes
+from services.llm import get_llm_model, invoke_concurrently
+from services.vector_search import SEARCH_BATCH_SIZE, batch_similarity_search, get_shared_vectorstore
+
+logger = logging.getLogger(__name__)
+
+# 向量库在第一次检索时才创建并在进程内复用
+EMBEDDING_MODEL = "text-embedding-3-small"
+COLLECTION_NAME = "hospital_departments"
+
+# 每个待匹配科室检索的参考文档数量
+RETRIEVAL_K = 6
+
+MATCH_FAILED = "匹配失败"
+
+# Sheet1 中的候选科室列，Sheet2 中待匹配科室的（二级科室，一级科室，科室简介）列，以及结果列
+CANDIDATE_COLUMN = '二级科室'
+PHYSICAL_COLUMNS = ['二级科室（物理科室）', '一级科室（物理科室）', '科室简介（物理科室）']
+RESULT_COLUMN = '二级科室（标准科室）'
+RESULT_FILE = "result.xlsx"
+
+
+def build_match_messages(dept_physical_level2, dept_physical_level1, dept_intro, candidate_departments):
+    return [
+        SystemMessage(content=f"""
+你将扮演医疗行业助手，负责将待匹配的科室与候选科室列表进行最合适的匹配。请基于提供的一级科室、科室简介、语义理解、医学常识作出判断，分析待匹配科室与候选科室之间的相关性，按照相关性高低排列输出 1 个或者多个匹配结果。请仅从候选科室列表中挑选科室，不能匹配出候选科室列表中不存在的科室。
+
+执行要求：
+1. 匹配逻辑：根据科室的一级科室、科室简介、名称、疾病、症状等信息进行匹配。如果需要，可以搜索相关疾病或症状以进一步确认匹配结果。
+2. 分析步骤：可以参考分析过程的思路并且一步步地进行分析，详细分析待匹配科室和背景中提到的关键词，如年龄段、疾病类型等，并结合候选科室做出合理推测。
+3. 输出格式：请只要输出“匹配结果”的内容，不能包含“匹配结果：”这一标题，“分析过程”部分可以隐去。
+
+案例
+- 待匹配科室： 炎性肌病多学科联合门诊
+- 待匹配科室的一级科室：多学科联合门诊(MDT)
+- 待匹配科室的简介：我院炎性肌病多学科联合门诊由风湿免疫科神经内科、心血管内科、病理科、呼吸内科等五个相关科室医生组成
+- 候选科室列表：风湿免疫科、神经内科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
+- 匹配结果：风湿免疫科、神经内科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
+        """),
+        HumanMessage(content=f"""
+- 待匹配科室：{dept_physical_level2}
+- 待匹配科室的一级科室：{dept_physical_level1}
+- 待匹配科室的简介：{dept_intro if pd.notna(dept_intro) and dept_intro and dept_intro != 'nan' else "无"}
+- 候选科室列表：{', '.join(candidate_departments)}
+- 匹配结果：
+        """)
+    ]
+
+
+def build_rag_match_messages(dept_physical_level2, dept_physical_level1, dept_intro, candidate_departments, context):
+    return [
+        SystemMessage(content=f"""
+你将扮演医疗行业助手，负责将待匹配的科室与候选科室列表进行最合适的匹配。请基于提供的一级科室、科室简介、语义理解、医学常识作出判断，分析待匹配科室与候选科室之间的相关性，按照相关性高低排列输出 1 个或者多个匹配结果。请仅从参考文档的二级科室以及候选科室列表中挑选科室，不能匹配出参考文档和候选科室列表中不存在的科室。
+如果参考文档中有匹配的二级科室，它们的优先级最高。
+
+参考文档：
+{context}
+
+执行要求：
+1. 匹配逻辑：根据科室的一级科室、科室简介、名称、疾病、症状等信息进行匹配。如果需要，可以搜索相关疾病或症状以进一步确认匹配结果。
+2. 分析步骤：可以参考分析过程的思路并且一步步地进行分析，详细分析待匹配科室和背景中提到的关键词，如年龄段、疾病类型等，并结合候选科室做出合理推测。
+3. 输出格式：请只要输出“匹配结果”的内容，不能包含“匹配结果：”这一标题，“分析过程”部分可以隐去。
+
+案例
+参考文档：
+- 一级科室: 内科
+- 二级科室: 神经内科
+
+- 待匹配科室： 炎性肌病多学科联合门诊
+- 待匹配科室的一级科室：多学科联合门诊(MDT)
+- 待匹配科室的简介：我院炎性肌病多学科联合门诊由风湿免疫科神经内科、心血管内科、病理科、呼吸内科等五个相关科室医生组成
+- 候选科室列表：风湿免疫科、神经内科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
+- 匹配结果：神经内科、风湿免疫科、心血管内科、呼吸内科、病理科、皮肤科、感染科、内分泌科
+        """),
+        HumanMessage(content=f"""
+- 待匹配科室：{dept_physical_level2}
+- 待匹配科室的一级科室：{dept_physical_level1}
+- 待匹配科室的简介：{dept_intro if pd.notna(dept_intro) and dept_intro and dept_intro != 'nan' else "无"}
+- 候选科室列表：{', '.join(candidate_departments)}
+- 匹配结果：
+        """)
+    ]
+
+
+def retrieve_contexts(departments):
+    # 批量计算查询向量并分块批量检索所有待匹配科室的参考文档；每块失败时指数退避重试，
+    # 重试后仍失败的块不使用参考文档，不影响其他块
+    queries = [f"二级科室：{dept_physical_level2}，科室简介：{dept_intro}"
+               for dept_physical_level2, _, dept_intro in departments]
+    if not queries:
+        return []
+
+    def search(chunk):
+        vectorstore = get_shared_vectorstore(COLLECTION_NAME, EMBEDDING_MODEL)
+        return batch_similarity_search(vectorstore, chunk, k=RETRIEVAL_K)
+
+    chunks = [queries[start:start + SEARCH_BATCH_SIZE] for start in range(0, len(queries), SEARCH_BATCH_SIZE)]
+    contexts = []
+    for chunk, retrieved in zip(chunks, invoke_concurrently(RunnableLambda(search), chunks)):
+        if isinstance(retrieved, Exception):
+            logger.warning(f"检索失败: {retrieved}")
+            contexts.extend([""] * len(chunk))
+            continue
+        for retrieved_docs in retrieved:
+            # 格式化检索到的文档作为上下文
+            context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+            logger.debug("RAG 过程中查询到的上下文: %s", context)
+            contexts.append(context)
+    return contexts
+
+
+def match_departments(departments, candidate_departments, rag=False, on_result=None, on_progress=None):
+    # 先在本地匹配名称明确的科室，只把无法确定的科室交给大模型；rag 为 True 时先检索参考文档
+    matcher = DepartmentMatcher(candidate_departments)
+    replies, tiers = prematch_departments([department[0] for department in departments], matcher)
+    if on_result is not None:
+        for index, reply in enumerate(replies):
+            if reply is not None:
+                on_result(index, reply)
+
+    escalated = [index for index, reply in enumerate(replies) if reply is None]
+    # 每行只把最相关的部分候选科室放进提示词
+    shortlists = {index: matcher.shortlist(departments[index][0], f"{departments[index][1]} {departments[index][2]}")
+                  for index in escalated}
+    model = get_llm_model(max_tokens=200)
+    if rag:
+        contexts = retrieve_contexts([departments[index] for index in escalated])
+        messages = [build_rag_match_messages(*departments[index], shortlists[index], context)
+                    for index, context in zip(escalated, contexts)]
+    else:
+        messages = [build_match_messages(*departments[index], shortlists[index]) for index in escalated]
+
+    def handle_result(position, resp):
+        index = escalated[position]
+        dept_physical_level2, dept_physical_level1, dept_intro = departments[index]
+        if isinstance(resp, Exception):
+            reply = MATCH_FAILED
+            logger.warning("科室名称: %s, 一级科室名称：%s, 匹配失败: %s", dept_physical_level2, dept_physical_level1, resp)
+        else:
+            reply = resp.content
+            # 逐行的候选科室和匹配结果只在 DEBUG 级别输出，调用量统计见监控页面
+            logger.debug("科室名称: %s, 一级科室名称：%s, 简介：%s, 科室候选：%s, 匹配结果: %s",
+                         dept_physical_level2, dept_physical_level1, dept_intro, shortlists[index], reply)
+        replies[index] = reply
+        if on_result is not None:
+            on_result(index, reply)
+
+    # 并发匹配所有科室，限流和失败重试由 invoke_concurrently 负责
+    invoke_concurrently(model, messages, on_progress=on_progress, on_result=handle_result)
+
+    return replies, Counter(tiers)
+
+
+def get_candidate_departments(df_sheet1):
+    return df_sheet1[CANDIDATE_COLUMN].dropna().astype(str).unique().tolist()
+
+
+def get_departments(df_sheet2):
+    # 待匹配的科室：（二级科室，一级科室，科室简介）
+    return list(zip(*(df_sheet2[column].astype(str) for column in PHYSICAL_COLUMNS)))
+
+
+def run_department_job(job):
+    # 后台任务：逐行保存匹配结果，任务中断后重新执行时只匹配尚未保存的行
+    input_path = job.file(job.params["input"])
+    df_sheet1 = read_table(input_path, sheet_name=job.params["sheet1"])
+    df_sheet2 = read_table(input_path, sheet_name=job.params["sheet2"])
+    candidate_departments = get_candidate_departments(df_sheet1)
+    departments = get_departments(df_sheet2)
+    job.set_total(len(departments))
+
+    # 各匹配层级的行数由本地预匹配决定，重新计算即可，不依赖之前保存的结果
+    _, tiers = prematch_departments([department[0] for department in departments],
+                                    DepartmentMatcher(candidate_departments))
+    job.set_summary(dict(Counter(tiers)))
+
+    pending = [index for index in range(len(departments)) if index not in job.results]
+    match_departments([departments[index] for index in pending], candidate_departments, rag=job.params["rag"],
+                      on_result=lambda position, reply: job.save_result(pending[position], reply))
+
+    df_sheet2[RESULT_COLUMN] = [job.results[index] for index in range(len(departments))]
+    with open(job.file(RESULT_FILE), "wb") as f:
+        f.write(to_excel_bytes(df_sheet2, sheet_name=job.params["sheet2"]))
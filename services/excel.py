@@ -0,0 +1,315 @@
+import hashlib
+import numbers
+import os
+import warnings
+from datetime import date, time, timedelta
+from io import BytesIO
+from typing import Any, Iterable, Iterator, List, Union
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from services.cache import LRUCache
+
+CHUNK_SIZE = 5000
+
+# 已解析的上传文件按内容哈希缓存，所有页面和会话共享同一份内存预算
+TABLE_CACHE_MAX_BYTES = int(os.environ.get("TABLE_CACHE_MAX_MB") or 512) * 1024 * 1024
+table_cache = LRUCache(max_bytes=TABLE_CACHE_MAX_BYTES)
+
+SheetName = Union[int, str]
+
+
+def _file_suffix(file) -> str:
+    name = getattr(file, "name", file)
+    return os.path.splitext(str(name))[1].lower()
+
+
+def _rewind(file) -> None:
+    # Streamlit 的 UploadedFile 在多次读取之间需要回到文件开头
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+
+def _convert_openpyxl_cell(cell) -> Any:
+    # 与 pandas 的 openpyxl 读取逻辑保持一致
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+
+def _convert_calamine_cell(value) -> Any:
+    # 与 pandas 的 calamine 读取逻辑保持一致
+    if isinstance(value, float):
+        as_int = int(value)
+        if as_int == value:
+            return as_int
+        return value
+    elif isinstance(value, date):
+        return pd.Timestamp(value)
+    elif isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    elif isinstance(value, time):
+        return value
+    return value
+
+
+def _iter_openpyxl_rows(file, sheet_name: SheetName) -> Iterator[List[Any]]:
+    from openpyxl import load_workbook
+
+    # 只读模式逐行流式读取，不在内存中构建整个工作簿
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet_name, int):
+            sheet = workbook.worksheets[sheet_name]
+        else:
+            sheet = workbook[sheet_name]
+        sheet.reset_dimensions()
+        for row in sheet.iter_rows():
+            yield [_convert_openpyxl_cell(cell) for cell in row]
+    finally:
+        workbook.close()
+
+
+def _iter_calamine_rows(file, sheet_name: SheetName) -> Iterator[List[Any]]:
+    from python_calamine import CalamineWorkbook
+
+    workbook = CalamineWorkbook.from_object(file)
+    if isinstance(sheet_name, int):
+        sheet = workbook.get_sheet_by_index(sheet_name)
+    else:
+        sheet = workbook.get_sheet_by_name(sheet_name)
+
+    # calamine 从第一个非空单元格开始迭代，补齐左上方的空白区域以保持与 pandas 一致的行列位置
+    start_row, start_column = sheet.start or (0, 0)
+    for _ in range(start_row):
+        yield []
+    padding = [""] * start_column
+    for row in sheet.iter_rows():
+        yield padding + [_convert_calamine_cell(value) for value in row]
+
+
+def _calamine_available() -> bool:
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _parse_rows(rows: List[List[Any]], columns: List[Any]) -> pd.DataFrame:
+    # 复用 pandas 读取 Excel 时的类型推断和空值处理；较短的行补齐为空单元格
+    for row in rows:
+        if len(row) < len(columns):
+            row.extend([""] * (len(columns) - len(row)))
+    parser = TextParser(rows, names=columns, header=None, skip_blank_lines=False)
+    return parser.read()
+
+
+def _trim_row(row: Iterable[Any]) -> List[Any]:
+    # 与 pandas 一致，去掉每行末尾的空单元格
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _column_names(header: List[Any], width: int) -> List[Any]:
+    # 表头去重以及空表头命名（Unnamed: n）交给 pandas 处理；数据行比表头宽时，多出的列同样命名为 Unnamed: n
+    return TextParser([header + [""] * (width - len(header))], header=0).read().columns.tolist()
+
+
+def _rows_to_chunks(rows: Iterable[List[Any]], chunk_size: int) -> Iterator[pd.DataFrame]:
+    rows = iter(rows)
+    header = _trim_row(next(rows, []))
+    if not header:
+        yield pd.DataFrame()
+        return
+
+    # 列数取表头和所有数据行中最宽的一行，没有表头的列不会被丢弃；宽度在读取过程中只增不减，
+    # 较早的块缺少的列在合并时补为空值
+    width = len(header)
+    buffer: List[List[Any]] = []
+    blank_rows: List[List[Any]] = []
+    yielded = False
+    for row in rows:
+        row = _trim_row(row)
+        if not row:
+            # 暂存空行，末尾的空行会被丢弃
+            blank_rows.append(row)
+            continue
+        buffer.extend(blank_rows)
+        blank_rows.clear()
+        buffer.append(row)
+        width = max(width, len(row))
+        if len(buffer) >= chunk_size:
+            yield _parse_rows(buffer, _column_names(header, width))
+            yielded = True
+            buffer = []
+
+    if buffer or not yielded:
+        yield _parse_rows(buffer, _column_names(header, width))
+
+
+def _infer_column(s: pd.Series) -> pd.Series:
+    # 用与逐块解析相同的类型推断重新解析整列，结果与一次性读取一致
+    values = s.astype(object).where(s.notna(), "").tolist()
+    column = TextParser([[value] for value in values], names=[0], header=None, skip_blank_lines=False).read()[0]
+    column.index = s.index
+    return column
+
+
+def iter_table_chunks(file, sheet_name: SheetName = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    # 按块读取上传的数据源（xls 除外），解析时不需要同时持有整个工作簿和解析结果
+    _rewind(file)
+    suffix = _file_suffix(file)
+
+    if suffix == ".csv":
+        with pd.read_csv(file, chunksize=chunk_size) as reader:
+            yield from reader
+    elif suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(file)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif suffix == ".xls":
+        # 旧版 xls 格式不支持流式读取
+        yield pd.read_excel(file, sheet_name=sheet_name)
+    elif _calamine_available():
+        yield from _rows_to_chunks(_iter_calamine_rows(file, sheet_name), chunk_size)
+    else:
+        yield from _rows_to_chunks(_iter_openpyxl_rows(file, sheet_name), chunk_size)
+
+
+def read_table(file, sheet_name: SheetName = 0, chunk_size: int = CHUNK_SIZE) -> pd.DataFrame:
+    # 调用方需要完整的数据框：所有块和合并结果会同时存在，峰值内存约为数据框大小的两倍，并不受块大小限制
+    chunks = list(iter_table_chunks(file, sheet_name, chunk_size))
+    if len(chunks) == 1:
+        return chunks[0]
+    with warnings.catch_warnings():
+        # 某个块中整列为空时沿用 pandas 当前的类型合并规则，与一次性读取的结果保持一致
+        warnings.simplefilter("ignore", FutureWarning)
+        df = pd.concat(chunks, ignore_index=True)
+    if _file_suffix(file) in (".csv", ".parquet"):
+        return df
+
+    # Excel 的各块分别推断类型，同一列在不同块中的类型不同（如布尔列只在部分块中有空值）或者较早的块缺少该列时，
+    # 合并后会变成 object 等与 pd.read_excel 不同的类型，这些列按整列重新推断
+    for i in range(df.shape[1]):
+        dtypes = {str(chunk.dtypes.iloc[i]) if i < chunk.shape[1] else None for chunk in chunks}
+        if len(dtypes) > 1:
+            df.isetitem(i, _infer_column(df.iloc[:, i]))
+    return df
+
+
+def file_digest(file) -> str:
+    if hasattr(file, "getvalue"):
+        content = file.getvalue()
+    else:
+        with open(file, "rb") as f:
+            content = f.read()
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_sheet_names(file) -> List[str]:
+    def read_sheet_names() -> List[str]:
+        _rewind(file)
+        if _file_suffix(file) in (".csv", ".parquet"):
+            return [os.path.splitext(os.path.basename(str(getattr(file, "name", file))))[0]]
+        if _file_suffix(file) == ".xls":
+            return pd.ExcelFile(file).sheet_names
+        if _calamine_available():
+            from python_calamine import CalamineWorkbook
+
+            return CalamineWorkbook.from_object(file).sheet_names
+
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(file, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+
+    return list(table_cache.get_or_create(("sheet_names", file_digest(file)), read_sheet_names))
+
+
+def load_table(file, sheet_name: SheetName = 0) -> pd.DataFrame:
+    # 页面每次交互都会重新执行，命中缓存时无需重新解析文件
+    key = (file_digest(file), sheet_name)
+    df = table_cache.get_or_create(key, lambda: read_table(file, sheet_name))
+    # 返回浅拷贝：调用方新增列不会影响缓存中的数据，但不能原地修改已有的值
+    return df.copy(deep=False)
+
+
+# xlsxwriter 无法把 inf 写成数字，与 pandas.to_excel 的默认行为一致写成文本
+INF_REPRESENTATION = "inf"
+
+
+def _excel_cell(value) -> Any:
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and not np.isfinite(value):
+        if np.isnan(value):
+            return None
+        return INF_REPRESENTATION if value > 0 else f"-{INF_REPRESENTATION}"
+    if isinstance(value, (str, numbers.Number, date, time, timedelta)):
+        return value
+    return str(value)
+
+
+def _excel_column(s: pd.Series) -> List[Any]:
+    # 把一个块内的一列批量转换成 xlsxwriter 可以直接写入的 Python 值，空值写成空单元格
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        if s.dt.tz is not None:
+            s = s.dt.tz_localize(None)
+        return s.astype(object).where(s.notna(), None).tolist()
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind in "biu":
+        return s.tolist()
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind == "f":
+        values = s.to_numpy()
+        result = values.astype(object)
+        result[np.isnan(values)] = None
+        result[np.isposinf(values)] = INF_REPRESENTATION
+        result[np.isneginf(values)] = f"-{INF_REPRESENTATION}"
+        return result.tolist()
+    return [_excel_cell(value) for value in s.tolist()]
+
+
+def to_excel_bytes(df: pd.DataFrame, sheet_name: str = "Sheet1") -> bytes:
+    import xlsxwriter
+
+    # constant_memory 模式逐行写出并立即落盘，内存占用与行数无关；
+    # pandas.to_excel 按列写单元格，不能与该模式一起使用，因此这里直接按行写入
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "strings_to_numbers": False,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+    worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+    # 每次只把 CHUNK_SIZE 行转换成 Python 值再逐行写出，转换产生的临时对象不随行数增长
+    for start in range(0, len(df), CHUNK_SIZE):
+        chunk = df.iloc[start:start + CHUNK_SIZE]
+        columns = [_excel_column(chunk.iloc[:, i]) for i in range(chunk.shape[1])]
+        for row_number, row in enumerate(zip(*columns), start=start + 1):
+            worksheet.write_row(row_number, 0, row)
+
+    workbook.close()
+    return output.getvalue()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+# 离线使用的大模型和 embeddings 替身（LLM_PROVIDER=fake），用于基准测试和本地调试：
+# 不发送任何网络请求，按请求内容确定性地生成回答，可以模拟延迟和失败
+
+_PACKED_TEXT_PATTERN = re.compile(r"^\d+\. (.*)$", re.M)
+_TEXT_PATTERN = re.compile(r"^文本：(.*)$", re.M)
+_CANDIDATES_PATTERN = re.compile(r"候选科室列表：(.*)$", re.M)
+_RULE_PATTERN = re.compile(r"^检测规则：(.*?)\s*$", re.M)
+# 替身模型能够理解的机械规则，其余规则的结论按文本哈希生成
+_LENGTH_RULE_PATTERN = re.compile(r"文本长度小于\s*(\d+)")
+
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _fraction(text: str) -> float:
+    return _digest(text) / 2 ** 64
+
+
+def _verdict(rule: str, text: str) -> str:
+    length_rule = _LENGTH_RULE_PATTERN.search(rule)
+    if length_rule:
+        return "是" if len(text) < int(length_rule.group(1)) else "否"
+    return "是" if _digest(text) % 4 else "否"
+
+
+def fake_reply(content: str) -> str:
+    # 根据提示词的格式返回对应形式的回答：规则编译返回表达式，打包检测返回 JSON 数组，逐条检测返回“是”/“否”，
+    # 科室匹配返回一个候选科室
+    rule = _RULE_PATTERN.search(content)
+    rule = rule.group(1) if rule else ""
+    if "表达式：" in content:
+        length_rule = _LENGTH_RULE_PATTERN.search(rule)
+        if length_rule:
+            return json.dumps({"type": "length", "max": int(length_rule.group(1)) - 1})
+        return json.dumps({"type": "unsupported"})
+    if "文本列表：" in content:
+        texts = [json.loads(text) for text in _PACKED_TEXT_PATTERN.findall(content)]
+        return json.dumps([_verdict(rule, text) for text in texts], ensure_ascii=False)
+    text = _TEXT_PATTERN.search(content)
+    if text:
+        return _verdict(rule, text.group(1))
+    candidates = _CANDIDATES_PATTERN.search(content)
+    if candidates:
+        names = [name.strip() for name in candidates.group(1).split(",") if name.strip()]
+        if names:
+            return names[_digest(content) % len(names)]
+    return "好的"
+
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = "fake"
+    # 每次请求的模拟延迟（秒），在此基础上按请求内容确定性地增加 0 到 jitter 倍的波动
+    latency: float = 0.0
+    jitter: float = 0.0
+    # 请求失败的概率，同一请求的每次重试独立判定，结果可复现
+    error_rate: float = 0.0
+
+    _attempts: Counter = PrivateAttr(default_factory=Counter)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        content = "\n".join(str(message.content) for message in messages)
+        with self._lock:
+            self._attempts[content] += 1
+            attempt = self._attempts[content]
+
+        if self.latency:
+            time.sleep(self.latency * (1 + self.jitter * _fraction(f"latency\n{attempt}\n{content}")))
+        if self.error_rate and _fraction(f"error\n{attempt}\n{content}") < self.error_rate:
+            raise RuntimeError("模拟的大模型请求失败")
+
+        reply = fake_reply(str(messages[-1].content))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+
+class FakeEmbeddings(Embeddings):
+    # 按文本哈希生成确定性的单位向量，相同文本的向量相同
+
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.random.default_rng(_digest(text)).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,406 @@
+import argparse
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services.metrics import flush as flush_metrics, metrics_scope
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 任务队列数据库以及每个任务的输入、输出文件目录
+JOBS_DIR = os.environ.get("JOBS_DIR") or os.path.join(ROOT_DIR, ".cache", "jobs")
+JOBS_DB_PATH = os.path.join(JOBS_DIR, "jobs.sqlite3")
+
+# 后台工作进程数量；页面提交任务时如果没有存活的工作进程，会自动在后台启动
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS") or 2)
+JOB_AUTOSTART_WORKERS = os.environ.get("JOB_AUTOSTART_WORKERS", "true").lower() not in ("false", "0", "no")
+
+# 心跳间隔，以及超过多久没有心跳就认为工作进程已经退出、把它的任务重新放回队列
+HEARTBEAT_SECONDS = 5
+STALE_SECONDS = 30
+
+# 同一任务最多被工作进程领取的次数：工作进程在执行任务时反复异常退出（如大文件导致内存不足）时，
+# 不再无限地重新排队，而是标记为失败
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS") or 3)
+
+# 已结束任务的上传文件和结果保留的时长，超过后由工作进程自动删除；页面上关闭任务时立即删除
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS") or 24)
+PURGE_INTERVAL_SECONDS = 600
+
+# 提交后台任务的页面展示的数据存储说明
+JOB_STORAGE_NOTICE = (f"数据隐私保护：上传的文件和处理结果不会被存储在任何云端，仅临时保存在服务器本地磁盘上，"
+                      f"用于在后台执行任务以及刷新页面后继续查看；点击“关闭任务”后立即删除，"
+                      f"任务结束 {JOB_RETENTION_HOURS:g} 小时后也会被自动删除。")
+
+# 逐条结果先缓存在内存中，攒够一批或超过间隔后再写入数据库
+CHECKPOINT_BATCH_SIZE = 100
+CHECKPOINT_INTERVAL_SECONDS = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# 任务类型对应的处理函数，按需导入，工作进程不需要预先加载所有页面逻辑
+JOB_HANDLERS = {
+    "anomaly": "services.anomaly:run_anomaly_job",
+    "department_matching": "services.department_matching:run_department_job",
+}
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    connection = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            total INTEGER,
+            completed INTEGER NOT NULL DEFAULT 0,
+            summary TEXT,
+            error TEXT,
+            worker_pid INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            heartbeat_at REAL
+        )
+    """)
+    # 兼容没有 attempts 列的旧数据库
+    if "attempts" not in {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}:
+        connection.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT NOT NULL,
+            item INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            PRIMARY KEY (job_id, item)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS workers (
+            pid INTEGER PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        )
+    """)
+    return connection
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def job_file(job_id: str, name: str) -> str:
+    return os.path.join(job_dir(job_id), name)
+
+
+def submit_job(kind: str, params: Dict[str, Any], files: Optional[Dict[str, bytes]] = None) -> str:
+    # 输入文件保存在任务目录中，参数里用文件名引用，页面刷新或工作进程重启后都可以重新读取
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unsupported job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    for name, content in (files or {}).items():
+        with open(job_file(job_id, name), "wb") as f:
+            f.write(content)
+
+    now = time.time()
+    connection = _connect()
+    try:
+        connection.execute(
+            "INSERT INTO jobs (id, kind, status, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(params, ensure_ascii=False), now, now),
+        )
+    finally:
+        connection.close()
+    if JOB_AUTOSTART_WORKERS:
+        ensure_workers()
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    connection = _connect()
+    try:
+        connection.row_factory = sqlite3.Row
+        row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["summary"] = json.loads(job["summary"]) if job["summary"] else {}
+    return job
+
+
+def get_job_results(job_id: str) -> Dict[int, Any]:
+    connection = _connect()
+    try:
+        rows = connection.execute("SELECT item, result FROM job_results WHERE job_id = ?", (job_id,)).fetchall()
+    finally:
+        connection.close()
+    return {item: json.loads(result) for item, result in rows}
+
+
+def get_job_results_since(job_id: str, after: int = 0) -> Tuple[Dict[int, Any], int]:
+    # 只返回上次读取之后新写入的结果，以及下次读取时传入的位置；页面轮询进度时不需要每次都读取全部结果
+    connection = _connect()
+    try:
+        rows = connection.execute("SELECT rowid, item, result FROM job_results WHERE job_id = ? AND rowid > ? "
+                                  "ORDER BY rowid", (job_id, after)).fetchall()
+    finally:
+        connection.close()
+    if not rows:
+        return {}, after
+    return {item: json.loads(result) for _, item, result in rows}, rows[-1][0]
+
+
+def delete_job(job_id: str) -> None:
+    connection = _connect()
+    try:
+        connection.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+        connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    finally:
+        connection.close()
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+class JobContext:
+    # 传给任务处理函数的上下文：读取参数和输入文件、逐条保存结果（断点）、设置总数和汇总信息
+
+    def __init__(self, connection: sqlite3.Connection, job: Dict[str, Any]):
+        self.id = job["id"]
+        self.params = json.loads(job["params"])
+        self._connection = connection
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        # 之前运行中已经保存的结果和汇总信息，恢复任务时跳过这些条目
+        self.results = get_job_results(self.id)
+        self.summary = json.loads(job["summary"]) if job.get("summary") else {}
+
+    def file(self, name: str) -> str:
+        return job_file(self.id, name)
+
+    def set_total(self, total: int) -> None:
+        self._connection.execute("UPDATE jobs SET total = ?, updated_at = ? WHERE id = ?",
+                                 (total, time.time(), self.id))
+
+    def set_summary(self, summary: Dict[str, Any]) -> None:
+        self.summary = summary
+        self._connection.execute("UPDATE jobs SET summary = ?, updated_at = ? WHERE id = ?",
+                                 (json.dumps(summary, ensure_ascii=False), time.time(), self.id))
+
+    def save_result(self, item: int, result: Any) -> None:
+        with self._lock:
+            self.results[item] = result
+            self._buffer.append((self.id, item, json.dumps(result, ensure_ascii=False)))
+            if (len(self._buffer) >= CHECKPOINT_BATCH_SIZE
+                    or time.monotonic() - self._last_flush > CHECKPOINT_INTERVAL_SECONDS):
+                self._flush()
+
+    def save_results(self, results: Dict[int, Any]) -> None:
+        # 一次保存大量结果（如规则编译后整列的结论），在同一个事务中写入
+        with self._lock:
+            self.results.update(results)
+            self._buffer.extend((self.id, item, json.dumps(result, ensure_ascii=False))
+                                for item, result in results.items())
+            self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany("INSERT OR REPLACE INTO job_results (job_id, item, result) VALUES (?, ?, ?)",
+                                         self._buffer)
+            self._connection.execute(
+                "UPDATE jobs SET completed = (SELECT COUNT(*) FROM job_results WHERE job_id = ?), updated_at = ? "
+                "WHERE id = ?", (self.id, time.time(), self.id))
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._buffer = []
+
+
+def _load_handler(kind: str) -> Callable[[JobContext], None]:
+    module_name, _, function_name = JOB_HANDLERS[kind].partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _requeue_stale_jobs(connection: sqlite3.Connection) -> None:
+    # 工作进程异常退出（或服务器重启）后，它正在执行的任务重新排队，已保存的结果不会重复计算；
+    # 已经领取过 JOB_MAX_ATTEMPTS 次的任务标记为失败
+    now = time.time()
+    connection.execute("UPDATE jobs SET status = ?, worker_pid = NULL, error = ?, updated_at = ? "
+                       "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                       (FAILED, f"工作进程在执行任务时异常退出了 {JOB_MAX_ATTEMPTS} 次", now,
+                        RUNNING, now - STALE_SECONDS, JOB_MAX_ATTEMPTS))
+    connection.execute("UPDATE jobs SET status = ?, worker_pid = NULL WHERE status = ? AND heartbeat_at < ?",
+                       (QUEUED, RUNNING, now - STALE_SECONDS))
+
+
+def _claim_job(connection: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    connection.row_factory = sqlite3.Row
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                 (QUEUED,)).fetchone()
+        if row is not None:
+            now = time.time()
+            connection.execute("UPDATE jobs SET status = ?, worker_pid = ?, heartbeat_at = ?, updated_at = ?, "
+                               "attempts = attempts + 1 WHERE id = ?", (RUNNING, os.getpid(), now, now, row["id"]))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.row_factory = None
+    return dict(row) if row is not None else None
+
+
+def _heartbeat(stop: threading.Event, state: Dict[str, Optional[str]]) -> None:
+    connection = _connect()
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            now = time.time()
+            connection.execute("INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (os.getpid(), now))
+            if state["job_id"] is not None:
+                connection.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker_pid = ?",
+                                   (now, state["job_id"], os.getpid()))
+    finally:
+        connection.close()
+
+
+def run_job(connection: sqlite3.Connection, job: Dict[str, Any]) -> None:
+    context = JobContext(connection, job)
+    try:
+        # 任务中的大模型调用按任务类型和任务 ID 记录指标
+        with metrics_scope(job["kind"], job["id"]):
+            _load_handler(job["kind"])(context)
+        context.flush()
+        connection.execute("UPDATE jobs SET status = ?, error = NULL, updated_at = ? WHERE id = ?",
+                           (COMPLETED, time.time(), job["id"]))
+        logger.info(f"任务 {job['id']}（{job['kind']}）已完成")
+    except Exception as e:
+        logger.exception(f"任务 {job['id']}（{job['kind']}）失败")
+        context.flush()
+        connection.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                           (FAILED, str(e), time.time(), job["id"]))
+    finally:
+        flush_metrics()
+
+
+def purge_expired_jobs(connection: sqlite3.Connection) -> None:
+    # 删除结束超过 JOB_RETENTION_HOURS 的任务，以及数据库中已不存在的任务留下的目录
+    expires_at = time.time() - JOB_RETENTION_HOURS * 3600
+    expired = [row[0] for row in connection.execute(
+        "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (COMPLETED, FAILED, expires_at))]
+    for job_id in expired:
+        delete_job(job_id)
+    known = {row[0] for row in connection.execute("SELECT id FROM jobs")}
+    for entry in os.scandir(JOBS_DIR):
+        try:
+            if entry.is_dir() and entry.name not in known and entry.stat().st_mtime < expires_at:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+    if expired:
+        logger.info(f"已删除 {len(expired)} 个过期任务")
+
+
+def worker_loop(poll_seconds: float = 1.0) -> None:
+    connection = _connect()
+    connection.execute("INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (os.getpid(), time.time()))
+    state: Dict[str, Optional[str]] = {"job_id": None}
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(stop, state), daemon=True).start()
+    logger.info(f"工作进程 {os.getpid()} 已启动")
+    last_purge = 0.0
+    try:
+        while True:
+            if time.monotonic() - last_purge >= PURGE_INTERVAL_SECONDS:
+                purge_expired_jobs(connection)
+                last_purge = time.monotonic()
+            _requeue_stale_jobs(connection)
+            job = _claim_job(connection)
+            if job is None:
+                time.sleep(poll_seconds)
+                continue
+            state["job_id"] = job["id"]
+            run_job(connection, job)
+            state["job_id"] = None
+    finally:
+        stop.set()
+        connection.execute("DELETE FROM workers WHERE pid = ?", (os.getpid(),))
+        connection.close()
+
+
+def live_worker_count() -> int:
+    connection = _connect()
+    try:
+        return connection.execute("SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?",
+                                  (time.time() - STALE_SECONDS,)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+_start_lock = threading.Lock()
+
+
+def ensure_workers() -> None:
+    # 没有存活的工作进程时在后台启动一组，独立于 Streamlit 进程运行，页面刷新或会话断开不影响任务
+    with _start_lock:
+        if live_worker_count() > 0:
+            return
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        with open(os.path.join(JOBS_DIR, "worker.log"), "ab") as log_file:
+            subprocess.Popen([sys.executable, "-m", "services.jobs", "--workers", str(JOB_WORKERS)], cwd=ROOT_DIR,
+                             stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+        # 等待工作进程注册，避免并发提交的任务重复启动工作进程
+        deadline = time.monotonic() + 10
+        while live_worker_count() == 0 and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="后台任务工作进程")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="工作进程数量")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    if args.workers == 1:
+        worker_loop()
+        return
+    processes = [multiprocessing.Process(target=worker_loop) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
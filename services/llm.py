@@ -1,12 +1,102 @@
+import contextvars
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from typing import Any, Optional, Dict
+from typing import Any, Callable, Optional, Dict, List, Sequence
 
 load_dotenv()
 
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY") or 8)
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES") or 3)
+
+_rate_limiters: Dict[str, Any] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(llm_provider: str):
+    # 每个大模型服务商共享一个限流器，例如 OPENAI_REQUESTS_PER_SECOND，未单独配置时使用 LLM_REQUESTS_PER_SECOND
+    requests_per_second = (os.environ.get(f"{llm_provider.upper()}_REQUESTS_PER_SECOND")
+                           or os.environ.get("LLM_REQUESTS_PER_SECOND"))
+    if not requests_per_second:
+        return None
+
+    with _rate_limiters_lock:
+        if llm_provider not in _rate_limiters:
+            from langchain_core.rate_limiters import InMemoryRateLimiter
+
+            _rate_limiters[llm_provider] = InMemoryRateLimiter(
+                requests_per_second=float(requests_per_second),
+                check_every_n_seconds=0.05,
+                max_bucket_size=max(1.0, float(requests_per_second)),
+            )
+        return _rate_limiters[llm_provider]
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    # 所有模型共享一个持久化的响应缓存，设置 LLM_CACHE_ENABLED=false 可以关闭
+    if os.environ.get("LLM_CACHE_ENABLED", "true").lower() in ("false", "0", "no"):
+        return None
+
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            from services.llm_cache import SQLiteLLMCache, DEFAULT_CACHE_PATH
+
+            _llm_cache = SQLiteLLMCache(
+                database_path=os.environ.get("LLM_CACHE_PATH") or DEFAULT_CACHE_PATH,
+                ttl_seconds=float(os.environ.get("LLM_CACHE_TTL_SECONDS") or 7 * 24 * 3600),
+                max_bytes=int(os.environ.get("LLM_CACHE_MAX_MB") or 256) * 1024 * 1024,
+            )
+        return _llm_cache
+
+
+_model_pool: Dict[Any, Any] = {}
+_model_pool_lock = threading.Lock()
+
+
+def _pool_key(llm_provider: str, params: Dict[str, Any]):
+    # 非基本类型的参数（如缓存、限流器、自定义 http 客户端）按对象身份区分
+    items = []
+    for name, value in sorted(params.items()):
+        if not isinstance(value, (str, int, float, bool, type(None))):
+            value = ("id", id(value))
+        items.append((name, value))
+    return llm_provider, tuple(items)
+
+
+def _get_pooled_model(llm_provider: str, model_class, params: Dict[str, Any]):
+    # 相同服务商和参数的模型客户端在进程内复用，所有会话和线程共享同一个 HTTP 连接池（keep-alive），
+    # 避免每次调用都重新建立连接和 TLS 握手
+    key = _pool_key(llm_provider, params)
+    with _model_pool_lock:
+        if key not in _model_pool:
+            _model_pool[key] = model_class(**params)
+        return _model_pool[key]
+
+
 def get_llm_model(max_tokens: Optional[int] = None, **kwargs):
     llm_provider = os.environ.get("LLM_PROVIDER", "azure_openai")
 
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        kwargs.setdefault("cache", llm_cache)
+
+    rate_limiter = get_rate_limiter(llm_provider)
+    if rate_limiter is not None:
+        kwargs.setdefault("rate_limiter", rate_limiter)
+
+    # 记录每次请求的延迟、token 数、重试和失败，见 services/metrics.py
+    from services.metrics import get_callbacks
+
+    callbacks = get_callbacks()
+    if callbacks is not None:
+        kwargs.setdefault("callbacks", callbacks)
+
     if llm_provider == "azure_openai":
         from langchain_openai import AzureChatOpenAI
 
@@ -21,7 +111,7 @@ def get_llm_model(max_tokens: Optional[int] = None, **kwargs):
             azure_params["max_tokens"] = max_tokens
         azure_params.update(kwargs)
 
-        model = AzureChatOpenAI(**azure_params)
+        model = _get_pooled_model(llm_provider, AzureChatOpenAI, azure_params)
     elif llm_provider == "openai":
         from langchain_openai import ChatOpenAI
 
@@ -39,7 +129,7 @@ def get_llm_model(max_tokens: Optional[int] = None, **kwargs):
 
         openai_params.update(kwargs)
 
-        model = ChatOpenAI(**openai_params)
+        model = _get_pooled_model(llm_provider, ChatOpenAI, openai_params)
     elif llm_provider == "ollama":
         from langchain_ollama import ChatOllama
 
@@ -55,8 +145,99 @@ def get_llm_model(max_tokens: Optional[int] = None, **kwargs):
 
         ollama_params.update(kwargs)
 
-        model = ChatOllama(**ollama_params)
+        model = _get_pooled_model(llm_provider, ChatOllama, ollama_params)
+    elif llm_provider == "fake":
+        # 离线替身模型，用于基准测试，不发送网络请求
+        from services.fake_llm import FakeChatModel
+
+        fake_params: Dict[str, Any] = {
+            "latency": float(os.environ.get("FAKE_LLM_LATENCY_MS") or 0) / 1000,
+            "jitter": float(os.environ.get("FAKE_LLM_JITTER") or 0),
+            "error_rate": float(os.environ.get("FAKE_LLM_ERROR_RATE") or 0),
+        }
+        fake_params.update(kwargs)
+
+        model = _get_pooled_model(llm_provider, FakeChatModel, fake_params)
     else:
         raise ValueError("Unsupported LLM_PROVIDER value.")
 
-    return model
\ No newline at end of file
+    return model
+
+
+def get_embedding_model(model: str):
+    # 向量检索使用 OpenAI 的 embeddings 模型，LLM_PROVIDER=fake 时使用离线替身
+    if os.environ.get("LLM_PROVIDER") == "fake":
+        from services.fake_llm import FakeEmbeddings
+
+        return FakeEmbeddings(latency=float(os.environ.get("FAKE_EMBEDDING_LATENCY_MS") or 0) / 1000)
+
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=model)
+
+
+# 常见模型的上下文窗口（token 数），按名称前缀匹配，越具体的前缀越靠前
+_CONTEXT_WINDOWS = [
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4-32k", 32768),
+    ("gpt-4", 8192),
+    ("gpt-35-turbo", 16385),
+    ("gpt-3.5-turbo", 16385),
+    ("moonshot-v1-128k", 131072),
+    ("moonshot-v1-32k", 32768),
+    ("moonshot-v1-8k", 8192),
+    ("qwen2.5", 32768),
+]
+DEFAULT_CONTEXT_WINDOW = 8192
+OLLAMA_DEFAULT_CONTEXT_WINDOW = 2048
+
+
+def get_context_window(model) -> int:
+    context_window = os.environ.get("LLM_CONTEXT_WINDOW")
+    if context_window:
+        return int(context_window)
+
+    # Ollama 的上下文窗口由 num_ctx 决定，未设置时使用 Ollama 的默认值
+    if type(model).__name__ == "ChatOllama":
+        return getattr(model, "num_ctx", None) or OLLAMA_DEFAULT_CONTEXT_WINDOW
+
+    names = [getattr(model, attr, None) for attr in ("deployment_name", "model_name", "model")]
+    for name in filter(None, names):
+        for prefix, window in _CONTEXT_WINDOWS:
+            if str(name).lower().startswith(prefix):
+                return window
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def estimate_tokens(text: str) -> int:
+    # 粗略估算：中文约 1 个字符 1 个 token，英文约 3～4 个字符 1 个 token，按 UTF-8 字节数偏保守地估算
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def invoke_concurrently(runnable, inputs: Sequence[Any], max_concurrency: Optional[int] = None,
+                        on_progress: Optional[Callable[[int, int], None]] = None,
+                        on_result: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+    # 在有界线程池中并发调用大模型（或检索器等其他 Runnable），失败时指数退避重试，结果按输入顺序返回；
+    # 重试后仍失败的位置返回异常对象
+    runnable = runnable.with_retry(stop_after_attempt=LLM_MAX_RETRIES, wait_exponential_jitter=True)
+    results: List[Any] = [None] * len(inputs)
+    if not inputs:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_concurrency or LLM_MAX_CONCURRENCY) as executor:
+        # 每个请求在调用方上下文的副本中执行，指标能够归属到发起调用的页面或任务
+        futures = {executor.submit(contextvars.copy_context().run, runnable.invoke, runnable_input): index
+                   for index, runnable_input in enumerate(inputs)}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+            # 回调在调用方线程中执行，可以直接更新页面
+            if on_result is not None:
+                on_result(index, results[index])
+            if on_progress is not None:
+                on_progress(completed, len(inputs))
+    return results
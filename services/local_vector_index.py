@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import uuid
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+VECTORS_FILE = "vectors.npy"
+DOCUMENTS_FILE = "documents.json"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class LocalVectorIndex:
+    # 进程内的向量索引：所有文档向量归一化后存放在一个连续的 float32 矩阵中，
+    # 一次矩阵乘法即可得到一批查询的余弦相似度，适合几十到几万条文档的小型语料
+
+    def __init__(self, vectors: np.ndarray, documents: Sequence[Document], embeddings: Optional[Embeddings] = None):
+        if len(vectors) != len(documents):
+            raise ValueError("向量数量与文档数量不一致")
+        self.vectors = vectors
+        self.documents = list(documents)
+        self.embeddings = embeddings
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document], embeddings: Embeddings) -> "LocalVectorIndex":
+        vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32)
+        vectors = vectors.reshape(len(documents), -1)
+        return cls(np.ascontiguousarray(_normalize(vectors), dtype=np.float32), documents, embeddings)
+
+    def save(self, directory: str) -> None:
+        # 两个文件先写入同一个临时目录，再整体改名替换原目录：中途崩溃不会留下只保存了一半的索引，
+        # 读取方也不会读到新旧混杂的向量和文档；其他进程正在内存映射的旧向量文件在替换后仍然有效
+        directory = os.path.normpath(directory)
+        tmp_directory = f"{directory}.{uuid.uuid4().hex}.tmp"
+        old_directory = f"{directory}.{uuid.uuid4().hex}.old"
+        os.makedirs(tmp_directory)
+        try:
+            with open(os.path.join(tmp_directory, VECTORS_FILE), "wb") as f:
+                np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+            with open(os.path.join(tmp_directory, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+                json.dump([{"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}
+                           for doc in self.documents], f, ensure_ascii=False)
+            # 非空目录不能直接被 os.replace 覆盖，先把原目录改名移开
+            if os.path.exists(directory):
+                os.replace(directory, old_directory)
+            os.replace(tmp_directory, directory)
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            shutil.rmtree(old_directory, ignore_errors=True)
+
+    @classmethod
+    def empty(cls, embeddings: Optional[Embeddings] = None) -> "LocalVectorIndex":
+        return cls(np.empty((0, 0), dtype=np.float32), [], embeddings)
+
+    @classmethod
+    def load(cls, directory: str, embeddings: Optional[Embeddings] = None, mmap: bool = True) -> "LocalVectorIndex":
+        # 默认以内存映射方式打开向量文件，多个进程可以共享同一份页缓存
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, DOCUMENTS_FILE), encoding="utf-8") as f:
+            documents = [Document(**doc) for doc in json.load(f)]
+        return cls(vectors, documents, embeddings)
+
+    def add_embeddings(self, documents: Sequence[Document], vectors: Sequence[Sequence[float]]) -> None:
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(documents), -1))
+        if len(self.documents):
+            vectors = np.concatenate([self.vectors, vectors])
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.documents.extend(documents)
+
+    def delete(self, ids: Sequence[str]) -> None:
+        ids = set(ids)
+        keep = [i for i, doc in enumerate(self.documents) if doc.id not in ids]
+        self.vectors = np.ascontiguousarray(self.vectors[keep], dtype=np.float32)
+        self.documents = [self.documents[i] for i in keep]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search_by_vectors(self, vectors: Sequence[Sequence[float]], k: int = 4) -> List[List[Document]]:
+        if len(vectors) == 0 or len(self.documents) == 0:
+            return [[] for _ in vectors]
+        queries = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        scores = queries @ self.vectors.T
+        k = min(k, len(self.documents))
+        # 先用 argpartition 取出每行的前 k 个，再只对这 k 个排序
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return [[self.documents[i] for i in row] for row in top.tolist()]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return self.search_by_vectors([self.embeddings.embed_query(query)], k)[0]
+
+    def as_retriever(self, k: int = 4) -> "LocalVectorIndexRetriever":
+        return LocalVectorIndexRetriever(index=self, k=k)
+
+
+class LocalVectorIndexRetriever(BaseRetriever):
+    # 让本地向量索引可以直接用在 create_retrieval_chain 等 LangChain 链中
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.index.similarity_search(query, self.k)
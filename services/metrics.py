@@ -0,0 +1,416 @@
+import argparse
+import atexit
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
+
+logger = logging.getLogger(__name__)
+
+# 大模型和 embeddings 调用的指标：先在进程内按分钟汇总，再定期合并写入本地 SQLite，
+# 页面进程和后台工作进程写入同一个数据库，监控页面和 Prometheus 接口从中读取
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() not in ("false", "0", "no")
+METRICS_PATH = os.environ.get("METRICS_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "metrics.sqlite3")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS") or 5)
+METRICS_RETENTION_DAYS = float(os.environ.get("METRICS_RETENTION_DAYS") or 7)
+
+CHAT = "chat"
+EMBEDDING = "embedding"
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+REQUESTS = "requests"
+ERRORS = "errors"
+RETRIES = "retries"
+CACHE_HITS = "cache_hits"
+INPUTS = "inputs"
+PROMPT_TOKENS = "prompt_tokens"
+COMPLETION_TOKENS = "completion_tokens"
+LATENCY_SUM = "latency_seconds_sum"
+LATENCY_BUCKET_PREFIX = "latency_bucket:"
+
+# 当前调用所属的页面或任务（scope, job_id），在线程池中执行的调用需要复制上下文才能继承
+_scope: contextvars.ContextVar[Tuple[str, str]] = contextvars.ContextVar("metrics_scope", default=("other", ""))
+
+
+@contextmanager
+def metrics_scope(scope: str, job_id: str = "") -> Iterator[None]:
+    token = _scope.set((scope, job_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _bucket_label(upper: float) -> str:
+    return "+Inf" if upper == float("inf") else repr(float(upper))
+
+
+def _latency_bucket(latency: float) -> str:
+    for upper in LATENCY_BUCKETS:
+        if latency <= upper:
+            return f"{LATENCY_BUCKET_PREFIX}{_bucket_label(upper)}"
+
+
+def _connect(database_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+    connection = sqlite3.connect(database_path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS metrics (
+            minute INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            model TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (minute, scope, job_id, kind, model, name)
+        )
+    """)
+    return connection
+
+
+class MetricsRecorder:
+    # 记录只更新内存中的计数，由后台线程定期批量写入数据库，不在调用路径上产生磁盘 I/O
+
+    def __init__(self, database_path: str = METRICS_PATH, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.database_path = database_path
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, str, str, str, str, str], float] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._last_cleanup = 0.0
+
+    def record(self, kind: str, model: str, values: Dict[str, float]) -> None:
+        scope, job_id = _scope.get()
+        minute = int(time.time() // 60 * 60)
+        with self._lock:
+            for name, value in values.items():
+                key = (minute, scope, job_id, kind, model or "unknown", name)
+                self._pending[key] = self._pending.get(key, 0) + value
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"写入指标失败: {e}")
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        connection = _connect(self.database_path)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT INTO metrics (minute, scope, job_id, kind, model, name, value) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (minute, scope, job_id, kind, model, name) DO UPDATE SET value = value + excluded.value",
+                [key + (value,) for key, value in pending.items()])
+            # 每小时清理一次超过保留期的数据
+            if time.time() - self._last_cleanup > 3600:
+                connection.execute("DELETE FROM metrics WHERE minute < ?",
+                                   (time.time() - METRICS_RETENTION_DAYS * 24 * 3600,))
+                self._last_cleanup = time.time()
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            with self._lock:
+                # 写入失败时把数据放回，下次再写
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+            raise
+        finally:
+            connection.close()
+
+
+recorder = MetricsRecorder()
+
+
+def record_call(kind: str, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                inputs: int = 1, error: bool = False, retry: bool = False) -> None:
+    if not METRICS_ENABLED:
+        return
+    recorder.record(kind, model, {
+        REQUESTS: 1,
+        INPUTS: inputs,
+        ERRORS: int(error),
+        RETRIES: int(retry),
+        PROMPT_TOKENS: prompt_tokens,
+        COMPLETION_TOKENS: completion_tokens,
+        LATENCY_SUM: latency,
+        _latency_bucket(latency): 1,
+    })
+
+
+def record_cache_hits(kind: str, model: str, count: int = 1) -> None:
+    if METRICS_ENABLED and count:
+        recorder.record(kind, model, {CACHE_HITS: count})
+
+
+def flush() -> None:
+    if METRICS_ENABLED:
+        recorder.flush()
+
+
+_local = threading.local()
+
+
+def mark_cache_hit() -> None:
+    # 由响应缓存在命中时调用：同一线程中正在进行的模型调用记为缓存命中，不计入请求数和延迟
+    _local.cache_hit = True
+
+
+def _estimate_tokens(text: str) -> int:
+    from services.llm import estimate_tokens
+
+    return estimate_tokens(text)
+
+
+def _model_name(serialized: Optional[Dict[str, Any]], metadata: Optional[Dict[str, Any]],
+                invocation_params: Optional[Dict[str, Any]]) -> str:
+    params = invocation_params or {}
+    return ((metadata or {}).get("ls_model_name") or params.get("model_name") or params.get("model")
+            or (serialized or {}).get("name") or "unknown")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    # 挂在 get_llm_model 返回的模型上，记录每次请求（包括每次重试）的延迟、token 数和失败
+
+    def __init__(self):
+        self._runs: Dict[Any, Tuple[float, str, int, bool]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs: Any) -> None:
+        _local.cache_hit = False
+        prompt_tokens = sum(_estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        retry = any(tag.startswith("retry:attempt:") for tag in tags or [])
+        model = _model_name(serialized, metadata, kwargs.get("invocation_params"))
+        with self._lock:
+            self._runs[run_id] = (time.perf_counter(), model, prompt_tokens, retry)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, model, prompt_tokens, retry = run
+        if getattr(_local, "cache_hit", False):
+            _local.cache_hit = False
+            record_cache_hits(CHAT, model)
+            return
+
+        # 优先使用服务商返回的 token 用量，没有时按文本估算
+        completion_tokens = 0
+        usage = None
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or usage
+                completion_tokens += _estimate_tokens(generation.text)
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        elif token_usage:
+            prompt_tokens = token_usage.get("prompt_tokens", prompt_tokens)
+            completion_tokens = token_usage.get("completion_tokens", completion_tokens)
+        record_call(CHAT, model, time.perf_counter() - start, prompt_tokens, completion_tokens, retry=retry)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, model, prompt_tokens, retry = run
+        record_call(CHAT, model, time.perf_counter() - start, prompt_tokens, error=True, retry=retry)
+
+
+# 所有模型共享同一个回调列表，模型池按对象身份区分参数，共享同一个列表才能复用模型
+_callbacks = [MetricsCallbackHandler()]
+
+
+def get_callbacks() -> Optional[List[BaseCallbackHandler]]:
+    return _callbacks if METRICS_ENABLED else None
+
+
+class InstrumentedEmbeddings(Embeddings):
+    # 包装 embeddings 模型，记录每次请求的延迟、文本数、估算的 token 数和失败
+
+    def __init__(self, embeddings: Embeddings, model: str):
+        self.embeddings = embeddings
+        self.model = model
+
+    def _call(self, function, texts: Sequence[str]):
+        start = time.perf_counter()
+        tokens = sum(_estimate_tokens(text) for text in texts)
+        try:
+            result = function()
+        except Exception:
+            record_call(EMBEDDING, self.model, time.perf_counter() - start, tokens, inputs=len(texts), error=True)
+            raise
+        record_call(EMBEDDING, self.model, time.perf_counter() - start, tokens, inputs=len(texts))
+        return result
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(lambda: self.embeddings.embed_documents(texts), texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(lambda: self.embeddings.embed_query(text), [text])
+
+
+class CacheCountingStore(ByteStore):
+    # 包装向量缓存的存储，统计 embeddings 的缓存命中数
+
+    def __init__(self, store: ByteStore, model: str):
+        self.store = store
+        self.model = model
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        values = self.store.mget(keys)
+        record_cache_hits(EMBEDDING, self.model, sum(value is not None for value in values))
+        return values
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        self.store.mset(key_value_pairs)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        self.store.mdelete(keys)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        return self.store.yield_keys(prefix=prefix)
+
+
+def load_metrics(since: Optional[float] = None, database_path: str = METRICS_PATH) -> pd.DataFrame:
+    if not os.path.exists(database_path):
+        return pd.DataFrame(columns=["minute", "scope", "job_id", "kind", "model", "name", "value"])
+    connection = _connect(database_path)
+    try:
+        return pd.read_sql_query("SELECT minute, scope, job_id, kind, model, name, value FROM metrics WHERE minute >= ?",
+                                 connection, params=(since or 0,))
+    finally:
+        connection.close()
+
+
+def latency_buckets(df: pd.DataFrame) -> pd.Series:
+    # 返回按桶上限排序的（非累计）请求数
+    buckets = df[df["name"].str.startswith(LATENCY_BUCKET_PREFIX)]
+    counts = buckets.groupby("name")["value"].sum()
+    counts.index = [float(name[len(LATENCY_BUCKET_PREFIX):]) for name in counts.index]
+    return counts.reindex(LATENCY_BUCKETS, fill_value=0)
+
+
+def latency_quantile(buckets: pd.Series, quantile: float) -> Optional[float]:
+    # 按直方图估算分位数，返回所在桶的上限
+    total = buckets.sum()
+    if not total:
+        return None
+    return float(buckets.index[(buckets.cumsum() >= quantile * total).argmax()])
+
+
+def summarize(df: pd.DataFrame, by: Sequence[str] = ("scope", "kind", "model")) -> pd.DataFrame:
+    by = list(by)
+    rows = []
+    for key, group in df.groupby(by):
+        totals = group.groupby("name")["value"].sum()
+        buckets = latency_buckets(group)
+        requests = totals.get(REQUESTS, 0)
+        minutes = group["minute"].nunique()
+        rows.append(dict(zip(by, key), **{
+            "请求数": int(requests),
+            "每分钟请求数": round(requests / minutes, 1) if minutes else 0,
+            "失败数": int(totals.get(ERRORS, 0)),
+            "重试数": int(totals.get(RETRIES, 0)),
+            "缓存命中数": int(totals.get(CACHE_HITS, 0)),
+            "输入 token": int(totals.get(PROMPT_TOKENS, 0)),
+            "输出 token": int(totals.get(COMPLETION_TOKENS, 0)),
+            "平均延迟(s)": round(totals.get(LATENCY_SUM, 0) / requests, 3) if requests else None,
+            "p50 延迟(s)": latency_quantile(buckets, 0.5),
+            "p95 延迟(s)": latency_quantile(buckets, 0.95),
+        }))
+    return pd.DataFrame(rows)
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{name}="{value}"'.replace("\n", " ") for name, value in labels.items())
+
+
+def prometheus_text(since: Optional[float] = None, database_path: str = METRICS_PATH) -> str:
+    # Prometheus 文本格式：按（页面或任务类型、调用类型、模型）汇总的计数器和延迟直方图，不按任务 ID 区分
+    df = load_metrics(since, database_path)
+    counters = [
+        (REQUESTS, "llm_requests_total", "Model requests, including retries"),
+        (ERRORS, "llm_errors_total", "Failed model requests"),
+        (RETRIES, "llm_retries_total", "Retried model requests"),
+        (CACHE_HITS, "llm_cache_hits_total", "Responses or embeddings served from cache"),
+        (INPUTS, "llm_inputs_total", "Texts sent to embeddings models, one per chat request"),
+        (PROMPT_TOKENS, "llm_prompt_tokens_total", "Prompt tokens"),
+        (COMPLETION_TOKENS, "llm_completion_tokens_total", "Completion tokens"),
+    ]
+    groups = list(df.groupby(["scope", "kind", "model"])) if not df.empty else []
+    lines = []
+    for name, metric, description in counters:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+        for (scope, kind, model), group in groups:
+            value = group.loc[group["name"] == name, "value"].sum()
+            lines.append(f"{metric}{{{_labels(scope=scope, kind=kind, model=model)}}} {value:g}")
+
+    metric = "llm_request_latency_seconds"
+    lines += [f"# HELP {metric} Model request latency", f"# TYPE {metric} histogram"]
+    for (scope, kind, model), group in groups:
+        labels = _labels(scope=scope, kind=kind, model=model)
+        buckets = latency_buckets(group)
+        for upper, count in buckets.cumsum().items():
+            lines.append(f'{metric}_bucket{{{labels},le="{_bucket_label(upper)}"}} {count:g}')
+        lines.append(f"{metric}_sum{{{labels}}} {group.loc[group['name'] == LATENCY_SUM, 'value'].sum():g}")
+        lines.append(f"{metric}_count{{{labels}}} {buckets.sum():g}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format, *args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以 Prometheus 文本格式提供大模型调用指标")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    logger.info(f"指标接口已启动: http://{args.host}:{args.port}/metrics")
+    ThreadingHTTPServer((args.host, args.port), _MetricsHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# 每页提取出的文本按 PDF 内容哈希缓存在磁盘上，同一份文件再次处理时不需要重新解析
+PDF_PAGE_CACHE_DIR = os.environ.get("PDF_PAGE_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "pdf_pages")
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS") or os.cpu_count() or 1)
+
+# 每个解析进程至少分到的页数，页数太少时进程启动的开销比解析本身更大
+MIN_PAGES_PER_WORKER = 4
+
+PAGE_COUNT_FILE = "page_count"
+
+
+def pdf_digest(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _cache_dir(digest: str) -> str:
+    return os.path.join(PDF_PAGE_CACHE_DIR, digest)
+
+
+def _write_cache(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def _extract_pages(file_path: str, pages: Sequence[int]) -> List[Tuple[int, str]]:
+    # 在子进程中执行：只解析指定的页面，与 PyPDFLoader 的文本提取方式保持一致
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [(page, reader.pages[page].extract_text()) for page in pages]
+
+
+def pdf_page_count(file_path: str, digest: Optional[str] = None) -> int:
+    digest = digest or pdf_digest(file_path)
+    path = os.path.join(_cache_dir(digest), PAGE_COUNT_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return int(f.read())
+
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    _write_cache(path, str(page_count))
+    return page_count
+
+
+def load_pdf_pages(file_path: str, pages: Optional[Sequence[int]] = None,
+                   max_workers: int = PDF_PARSE_WORKERS) -> List[Document]:
+    # 返回与 PyPDFLoader 相同格式的 Document（page 从 0 开始），只解析请求的、尚未缓存的页面，并在多个进程中并行解析
+    digest = pdf_digest(file_path)
+    if pages is None:
+        pages = range(pdf_page_count(file_path, digest))
+
+    texts = {}
+    missing = []
+    for page in dict.fromkeys(pages):
+        path = os.path.join(_cache_dir(digest), f"{page}.txt")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                texts[page] = f.read()
+        else:
+            missing.append(page)
+
+    workers = max(1, min(max_workers, len(missing) // MIN_PAGES_PER_WORKER))
+    if workers == 1:
+        extracted = _extract_pages(file_path, missing) if missing else []
+    else:
+        # 连续的页面分给同一个进程，每个进程只打开一次 PDF
+        size = -(-len(missing) // workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_pages, file_path, missing[start:start + size])
+                       for start in range(0, len(missing), size)]
+            extracted = [item for future in futures for item in future.result()]
+
+    for page, text in extracted:
+        _write_cache(os.path.join(_cache_dir(digest), f"{page}.txt"), text)
+        texts[page] = text
+
+    return [Document(page_content=texts[page], metadata={"source": file_path, "page": page}) for page in pages]
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from services.comparison import DIFF_FLAG_COLUMN, DIFF_SUFFIX, DIFF_TYPE_COLUMN, HAS_DIFF
+
+# 比较结果以未压缩的 Arrow IPC 文件保存在本地磁盘上并以内存映射方式读取，多个会话共享同一份文件，
+# 页面每次只读取当前页的行；另外保存逐行、逐列的差异掩码，用于筛选和计数
+RESULT_STORE_DIR = os.environ.get("RESULT_STORE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "comparison_results")
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_MB") or 2048) * 1024 * 1024
+
+# 文件格式或比较逻辑变化时修改版本号，旧的结果会重新生成
+STORE_VERSION = 2
+
+TABLE_FILE = "result.arrow"
+CHANGED_FILE = "changed.npy"
+ROW_CHANGED_FILE = "row_changed.npy"
+META_FILE = "meta.json"
+
+# 每个结果缓存的筛选后行号数量，翻页时不需要重新扫描掩码
+FILTER_CACHE_SIZE = 8
+
+
+def _to_arrow_column(s: pd.Series) -> pa.Array:
+    try:
+        return pa.array(s, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # 混合类型的列（如同一列中既有数字又有文本）按文本保存，只影响页面展示
+        return pa.array(s.astype(str).where(s.notna(), None), type=pa.string())
+
+
+class ResultStore:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # Arrow 文件和掩码都以内存映射方式打开，数据在访问时才按页读入，并由操作系统在进程内共享
+        self._table = pa.ipc.open_file(pa.memory_map(os.path.join(directory, TABLE_FILE))).read_all()
+        self._changed = np.load(os.path.join(directory, CHANGED_FILE), mmap_mode="r")
+        self._row_changed = np.load(os.path.join(directory, ROW_CHANGED_FILE), mmap_mode="r")
+        self._filters: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def write(cls, directory: str, df_all: pd.DataFrame, mapped_columns: Sequence[Any]) -> "ResultStore":
+        # 先写入临时目录再整体改名，其他进程不会读到写了一半的结果
+        tmp_directory = f"{directory}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_directory)
+        try:
+            # Arrow 的列名必须是不重复的字符串，原始列名保存在 meta.json 中
+            table = pa.Table.from_arrays([_to_arrow_column(df_all.iloc[:, i]) for i in range(df_all.shape[1])],
+                                         names=[f"c{i}" for i in range(df_all.shape[1])])
+            with pa.OSFile(os.path.join(tmp_directory, TABLE_FILE), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+            # 按列存放（Fortran 顺序），筛选某一列时只读取这一列的掩码
+            changed = np.empty((len(df_all), len(mapped_columns)), dtype=bool, order="F")
+            for j, column in enumerate(mapped_columns):
+                changed[:, j] = (df_all[f"{column}{DIFF_SUFFIX}"] != "").to_numpy()
+            row_changed = (df_all[DIFF_FLAG_COLUMN] == HAS_DIFF).to_numpy()
+            np.save(os.path.join(tmp_directory, CHANGED_FILE), changed)
+            np.save(os.path.join(tmp_directory, ROW_CHANGED_FILE), row_changed)
+
+            meta = {
+                "columns": df_all.columns.tolist(),
+                "mapped_columns": list(mapped_columns),
+                "rows": len(df_all),
+                "changed_rows": int(row_changed.sum()),
+                "changed_counts": changed.sum(axis=0).tolist(),
+                "diff_type_counts": (df_all[DIFF_TYPE_COLUMN].value_counts().to_dict()
+                                     if DIFF_TYPE_COLUMN in df_all.columns else None),
+            }
+            with open(os.path.join(tmp_directory, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+            try:
+                os.replace(tmp_directory, directory)
+            except OSError:
+                # 其他进程已经写入了相同的结果，直接使用已有的结果
+                if not os.path.exists(os.path.join(directory, META_FILE)):
+                    raise
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+        return cls(directory)
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    @property
+    def columns(self) -> List[Any]:
+        return self.meta["columns"]
+
+    @property
+    def changed_rows(self) -> int:
+        return self.meta["changed_rows"]
+
+    @property
+    def diff_type_counts(self) -> Optional[Dict[str, int]]:
+        return self.meta["diff_type_counts"]
+
+    def changed_counts(self) -> Dict[Any, int]:
+        # 每个比较列有差异的行数
+        return dict(zip(self.meta["mapped_columns"], self.meta["changed_counts"]))
+
+    def filter_rows(self, changed_only: bool = False, changed_columns: Sequence[Any] = ()) -> Optional[np.ndarray]:
+        # 返回符合筛选条件的行号，不筛选时返回 None；changed_columns 中的每一列都必须有差异
+        if not changed_only and not changed_columns:
+            return None
+        key = (changed_only, tuple(changed_columns))
+        with self._lock:
+            if key in self._filters:
+                self._filters.move_to_end(key)
+                return self._filters[key]
+
+        mask = np.array(self._row_changed) if changed_only else np.ones(len(self), dtype=bool)
+        positions = {column: j for j, column in enumerate(self.meta["mapped_columns"])}
+        for column in changed_columns:
+            mask &= self._changed[:, positions[column]]
+        rows = np.flatnonzero(mask)
+
+        with self._lock:
+            self._filters[key] = rows
+            while len(self._filters) > FILTER_CACHE_SIZE:
+                self._filters.popitem(last=False)
+        return rows
+
+    def page(self, offset: int, limit: int, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        # 只读取当前页的行，索引为结果中的行号
+        indices = np.arange(offset, min(offset + limit, len(self))) if rows is None else rows[offset:offset + limit]
+        df = self._table.take(pa.array(indices, type=pa.int64())).to_pandas()
+        df.columns = self.columns
+        df.index = indices
+        return df
+
+
+def _store_directory(result_key: Hashable) -> str:
+    digest = hashlib.sha256(f"{STORE_VERSION}\n{result_key!r}".encode("utf-8")).hexdigest()
+    return os.path.join(RESULT_STORE_DIR, digest)
+
+
+def _directory_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def _evict_stores(keep: str) -> None:
+    # 超出空间上限时按最近使用时间删除最旧的结果，当前结果除外；其他进程可能同时在删除，已不存在的结果直接跳过
+    if not os.path.isdir(RESULT_STORE_DIR):
+        return
+    stores = []
+    for entry in os.scandir(RESULT_STORE_DIR):
+        if not entry.is_dir() or entry.name.endswith(".tmp"):
+            continue
+        try:
+            stores.append((os.path.getmtime(os.path.join(entry.path, META_FILE)), _directory_size(entry.path),
+                           entry.path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in stores)
+    for _, size, store in sorted(stores):
+        if total <= RESULT_STORE_MAX_BYTES:
+            break
+        if store != keep:
+            shutil.rmtree(store, ignore_errors=True)
+            total -= size
+
+
+_stores: "OrderedDict[Hashable, ResultStore]" = OrderedDict()
+_stores_lock = threading.Lock()
+_build_locks: Dict[str, threading.Lock] = {}
+
+
+def get_result_store(result_key: Hashable, compute: Callable[[], pd.DataFrame],
+                     mapped_columns: Sequence[Any]) -> ResultStore:
+    # 相同的比较结果（文件哈希、列映射、关键列）只计算并写入一次，之后所有会话直接打开磁盘上的结果；
+    # 完整的结果数据框写入后即释放，不在内存中保留
+    directory = _store_directory(result_key)
+    with _stores_lock:
+        if directory in _stores:
+            _stores.move_to_end(directory)
+            return _stores[directory]
+        build_lock = _build_locks.setdefault(directory, threading.Lock())
+
+    with build_lock:
+        store = None
+        if os.path.exists(os.path.join(directory, META_FILE)):
+            try:
+                # 记录最近使用时间，淘汰时优先保留
+                os.utime(os.path.join(directory, META_FILE))
+                store = ResultStore(directory)
+            except FileNotFoundError:
+                # 结果刚好被其他进程淘汰，重新计算
+                store = None
+        if store is None:
+            os.makedirs(RESULT_STORE_DIR, exist_ok=True)
+            store = ResultStore.write(directory, compute(), mapped_columns)
+            _evict_stores(keep=directory)
+
+    with _stores_lock:
+        _stores[directory] = store
+        # 只保留最近使用的若干个打开的结果，其余的关闭内存映射
+        while len(_stores) > FILTER_CACHE_SIZE * 4:
+            _stores.popitem(last=False)
+    return store
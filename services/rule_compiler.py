@@ -0,0 +1,214 @@
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import regex
+from langchain_core.messages import HumanMessage, SystemMessage
+
+# 把自然语言的检测规则翻译成受限的表达式（正则、长度、数值范围、集合），表达式只包含下面这些类型，
+# 由本模块解释执行，不会执行模型生成的任何代码
+REGEX = "regex"
+LENGTH = "length"
+RANGE = "range"
+IN = "in"
+NOT = "not"
+ALL = "all"
+ANY = "any"
+UNSUPPORTED = "unsupported"
+
+MAX_PATTERN_LENGTH = 200
+MAX_SET_SIZE = 1000
+MAX_DEPTH = 4
+
+# 在整列文本上计算一个正则表达式的总时间上限（秒），超时后放弃编译该规则
+REGEX_TIMEOUT_SECONDS = 2.0
+
+RULE_COMPILE_PROMPT = """
+你是一名数据分析助手，负责把数据检测规则翻译成结构化的检测表达式。表达式为 JSON，判断一条文本是否**符合**规则，只能使用以下类型：
+
+- {"type": "regex", "pattern": "正则表达式", "fullmatch": false}：文本中包含匹配正则的内容；fullmatch 为 true 时要求整条文本完全匹配
+- {"type": "length", "min": 最小长度, "max": 最大长度}：文本的字符数在范围内（包含两端），min 和 max 可以省略其一
+- {"type": "range", "min": 最小值, "max": 最大值, "min_inclusive": true, "max_inclusive": true}：文本是数字且在范围内，min 和 max 可以省略其一
+- {"type": "in", "values": ["取值1", "取值2"]}：文本等于其中之一
+- {"type": "not", "check": 表达式}：不符合其中的表达式
+- {"type": "all", "checks": [表达式, ...]}：同时符合所有表达式
+- {"type": "any", "checks": [表达式, ...]}：符合任意一个表达式
+
+如果规则需要理解语义（如情感、是否通顺、是否合理），无法用上述表达式准确判断，请输出 {"type": "unsupported"}。
+请仅输出一个 JSON 对象，不需要任何解释。
+
+**示例**：
+- 检测规则：文本长度小于 10
+- 表达式：{"type": "length", "max": 9}
+
+- 检测规则：包含英文
+- 表达式：{"type": "regex", "pattern": "[A-Za-z]"}
+
+- 检测规则：是合法手机号
+- 表达式：{"type": "regex", "pattern": "1[3-9]\\\\d{9}", "fullmatch": true}
+
+- 检测规则：数值在 0 到 100 之间
+- 表达式：{"type": "range", "min": 0, "max": 100}
+
+- 检测规则：性别为男或女
+- 表达式：{"type": "in", "values": ["男", "女"]}
+
+- 检测规则：不包含数字且不超过 20 个字
+- 表达式：{"type": "all", "checks": [{"type": "not", "check": {"type": "regex", "pattern": "\\\\d"}}, {"type": "length", "max": 20}]}
+
+- 检测规则：评论的情感是积极的
+- 表达式：{"type": "unsupported"}
+"""
+
+
+def build_compile_messages(rule):
+    return [
+        SystemMessage(content=RULE_COMPILE_PROMPT),
+        HumanMessage(content=f"""
+检测规则：{rule}
+表达式：
+"""),
+    ]
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+def _has_nested_repetition(pattern: str) -> bool:
+    # 被 *、+、{m,n} 重复的分组中如果还包含重复或者分支（如 (a+)+、((a+))+、(?:a|a)*），
+    # 回溯次数可能随文本长度指数增长，直接拒绝；分组内外的嵌套分组逐层向外传递
+    groups: List[Dict[str, bool]] = [{"repeated": False, "alternation": False}]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 2
+            continue
+        if char == "[":
+            # 跳过字符集，字符集中的特殊字符没有分组或重复的含义
+            i += 1
+            if i < len(pattern) and pattern[i] == "^":
+                i += 1
+            if i < len(pattern) and pattern[i] == "]":
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        if char == "(":
+            groups.append({"repeated": False, "alternation": False})
+        elif char == ")" and len(groups) > 1:
+            inner = groups.pop()
+            quantifier = re.match(r"[*+]|\{\d*,\d*\}|\{\d*[2-9]\d*\}|\{\d{2,}\}", pattern[i + 1:])
+            if quantifier and (inner["repeated"] or inner["alternation"]):
+                return True
+            groups[-1]["repeated"] |= inner["repeated"] or bool(quantifier)
+            groups[-1]["alternation"] |= inner["alternation"]
+        elif char == "|":
+            groups[-1]["alternation"] = True
+        elif char in "*+" or (char == "{" and re.match(r"\{\d*,\d*\}", pattern[i:])):
+            # 固定次数的重复（如 \d{3}）只有一种匹配方式，不会导致回溯
+            groups[-1]["repeated"] = True
+        i += 1
+    return False
+
+
+def validate_spec(spec: Any, depth: int = 0) -> bool:
+    # 检查表达式只包含允许的类型和参数，正则可以编译且没有嵌套重复
+    if not isinstance(spec, dict) or depth > MAX_DEPTH:
+        return False
+    spec_type = spec.get("type")
+    if spec_type == REGEX:
+        pattern = spec.get("pattern")
+        if not isinstance(pattern, str) or not pattern or len(pattern) > MAX_PATTERN_LENGTH:
+            return False
+        if _has_nested_repetition(pattern) or not isinstance(spec.get("fullmatch", False), bool):
+            return False
+        try:
+            regex.compile(pattern)
+        except regex.error:
+            return False
+        return True
+    if spec_type in (LENGTH, RANGE):
+        bounds = [spec[key] for key in ("min", "max") if spec.get(key) is not None]
+        if not bounds or not all(_is_number(bound) for bound in bounds):
+            return False
+        if spec_type == RANGE:
+            return all(isinstance(spec.get(key, True), bool) for key in ("min_inclusive", "max_inclusive"))
+        return True
+    if spec_type == IN:
+        values = spec.get("values")
+        return (isinstance(values, list) and 0 < len(values) <= MAX_SET_SIZE
+                and all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values))
+    if spec_type == NOT:
+        return validate_spec(spec.get("check"), depth + 1)
+    if spec_type in (ALL, ANY):
+        checks = spec.get("checks")
+        return (isinstance(checks, list) and len(checks) > 0
+                and all(validate_spec(check, depth + 1) for check in checks))
+    return False
+
+
+def parse_rule_spec(content: str) -> Optional[Dict[str, Any]]:
+    # 返回合法的表达式，模型认为无法编译或者输出不合法时返回 None
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        spec = json.loads(content[start:end + 1])
+    except ValueError:
+        return None
+    if not validate_spec(spec):
+        return None
+    return spec
+
+
+def _evaluate_regex(pattern: str, fullmatch: bool, texts: pd.Series,
+                    timeout: Optional[float] = None) -> np.ndarray:
+    # 使用 regex 模块计算正则，整列共用一个超时时间；超时抛出 TimeoutError，由调用方放弃编译该规则。
+    # 包成非捕获分组，分支（a|b）作为整体参与 fullmatch
+    compiled = regex.compile(f"(?:{pattern})")
+    match = compiled.fullmatch if fullmatch else compiled.search
+    deadline = time.monotonic() + (REGEX_TIMEOUT_SECONDS if timeout is None else timeout)
+    result = np.zeros(len(texts), dtype=bool)
+    for position, text in enumerate(texts.tolist()):
+        if isinstance(text, str):
+            result[position] = match(text, timeout=max(deadline - time.monotonic(), 0.001)) is not None
+    return result
+
+
+def evaluate_spec(spec: Dict[str, Any], texts: pd.Series) -> np.ndarray:
+    # 在整列文本上向量化地计算表达式，返回每条文本是否符合规则；正则超时抛出 TimeoutError
+    spec_type = spec["type"]
+    if spec_type == REGEX:
+        return _evaluate_regex(spec["pattern"], spec.get("fullmatch", False), texts)
+    if spec_type == LENGTH:
+        lengths = texts.str.len().to_numpy()
+        result = np.ones(len(texts), dtype=bool)
+        if spec.get("min") is not None:
+            result &= lengths >= spec["min"]
+        if spec.get("max") is not None:
+            result &= lengths <= spec["max"]
+        return result
+    if spec_type == RANGE:
+        # 无法解析为数字的文本不符合规则
+        numbers = pd.to_numeric(texts.str.strip(), errors="coerce").to_numpy(dtype=float)
+        result = ~np.isnan(numbers)
+        if spec.get("min") is not None:
+            result &= numbers >= spec["min"] if spec.get("min_inclusive", True) else numbers > spec["min"]
+        if spec.get("max") is not None:
+            result &= numbers <= spec["max"] if spec.get("max_inclusive", True) else numbers < spec["max"]
+        return result
+    if spec_type == IN:
+        return texts.isin([str(value) for value in spec["values"]]).to_numpy(dtype=bool)
+    if spec_type == NOT:
+        return ~evaluate_spec(spec["check"], texts)
+    if spec_type == ALL:
+        return np.logical_and.reduce([evaluate_spec(check, texts) for check in spec["checks"]])
+    if spec_type == ANY:
+        return np.logical_or.reduce([evaluate_spec(check, texts) for check in spec["checks"]])
+    raise ValueError(f"不支持的表达式类型: {spec_type}")
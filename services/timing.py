@@ -0,0 +1,34 @@
+import logging
+import threading
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+_page_loads: Dict[str, List[float]] = {}
+_page_loads_lock = threading.Lock()
+
+
+def record_page_load(page: str, seconds: float) -> bool:
+    # 记录页面脚本从开始执行到渲染出主要控件的耗时，进程内第一次加载为冷启动，之后为热启动
+    with _page_loads_lock:
+        loads = _page_loads.setdefault(page, [])
+        loads.append(seconds)
+        cold = len(loads) == 1
+    logger.info(f"页面 {page} 加载耗时 {seconds:.3f}s（{'冷启动' if cold else '热启动'}）")
+    return cold
+
+
+def page_load_report() -> List[Dict[str, Any]]:
+    with _page_loads_lock:
+        loads = {page: list(seconds) for page, seconds in _page_loads.items()}
+    report = []
+    for page, seconds in loads.items():
+        warm = seconds[1:]
+        report.append({
+            "页面": page,
+            "加载次数": len(seconds),
+            "冷启动耗时(s)": round(seconds[0], 3),
+            "热启动平均耗时(s)": round(sum(warm) / len(warm), 3) if warm else None,
+            "最近一次耗时(s)": round(seconds[-1], 3),
+        })
+    return report
@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from services.local_vector_index import LocalVectorIndex
+
+logger = logging.getLogger(__name__)
+
+# 每次 embed_documents 请求包含的文本数，以及每条 SQL 同时检索的查询向量数
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE") or 256)
+SEARCH_BATCH_SIZE = 200
+
+# 向量库后端：pgvector（默认，需要 DATABASE_URL）或 local（本地 NumPy 索引文件，无需数据库）
+VECTOR_STORE = os.environ.get("VECTOR_STORE") or "pgvector"
+LOCAL_VECTOR_INDEX_DIR = os.environ.get("LOCAL_VECTOR_INDEX_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "vector_index")
+
+# 文档向量的磁盘缓存目录，键由模型名和文本哈希组成
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "embeddings")
+
+# 批量检索直接执行 SQL，只依赖 PGVector 的公开接口（get_collection、EmbeddingStore）：
+# 数据库会话由这里按 DATABASE_URL 创建，距离策略由这里创建 PGVector 时显式指定，不读取其私有属性
+PGVECTOR_DISTANCE_STRATEGY = "cosine"
+
+# PGVector 的距离策略对应的 pgvector 运算符
+_DISTANCE_OPERATORS = {
+    "cosine": "<=>",
+    "l2": "<->",
+    "inner": "<#>",
+}
+
+_engines: Dict[str, Any] = {}
+_engines_lock = threading.Lock()
+
+
+def _pgvector_session():
+    import sqlalchemy
+    from sqlalchemy.orm import Session
+
+    url = os.getenv("DATABASE_URL")
+    with _engines_lock:
+        if url not in _engines:
+            _engines[url] = sqlalchemy.create_engine(url)
+        return Session(_engines[url])
+
+
+def embed_queries(embeddings: Embeddings, queries: Sequence[str],
+                  batch_size: int = EMBEDDING_BATCH_SIZE) -> List[List[float]]:
+    # 相同的查询只计算一次向量，其余的按批调用 embed_documents，而不是每个查询单独请求一次
+    unique_queries = list(dict.fromkeys(queries))
+    vectors = {}
+    for start in range(0, len(unique_queries), batch_size):
+        batch = unique_queries[start:start + batch_size]
+        vectors.update(zip(batch, embeddings.embed_documents(batch)))
+    return [vectors[query] for query in queries]
+
+
+def _vector_literal(vector: Sequence[float]) -> str:
+    return "[" + ",".join(repr(float(value)) for value in vector) + "]"
+
+
+def pgvector_search_by_vectors(vectorstore, vectors: Sequence[Sequence[float]], k: int) -> List[List[Document]]:
+    # 用一条 LATERAL 查询同时完成多个查询向量的 k 近邻检索，结果按输入顺序返回
+    import sqlalchemy
+
+    operator = _DISTANCE_OPERATORS[PGVECTOR_DISTANCE_STRATEGY]
+    table = vectorstore.EmbeddingStore.__tablename__
+    statement = sqlalchemy.text(f"""
+        SELECT q.ord, e.id, e.document, e.cmetadata
+        FROM unnest(CAST(:embeddings AS text[])) WITH ORDINALITY AS q(query_embedding, ord)
+        CROSS JOIN LATERAL (
+            SELECT id, document, cmetadata, embedding {operator} CAST(q.query_embedding AS vector) AS distance
+            FROM {table}
+            WHERE collection_id = :collection_id
+            ORDER BY distance
+            LIMIT :k
+        ) AS e
+        ORDER BY q.ord, e.distance
+    """)
+
+    results: List[List[Document]] = [[] for _ in vectors]
+    with _pgvector_session() as session:
+        collection = vectorstore.get_collection(session)
+        if not collection:
+            raise ValueError("Collection not found")
+        for start in range(0, len(vectors), SEARCH_BATCH_SIZE):
+            batch = [_vector_literal(vector) for vector in vectors[start:start + SEARCH_BATCH_SIZE]]
+            rows = session.execute(statement, {"embeddings": batch, "collection_id": collection.uuid, "k": k})
+            for ord_, id_, document, metadata in rows:
+                results[start + ord_ - 1].append(Document(id=str(id_), page_content=document, metadata=metadata or {}))
+    return results
+
+
+def batch_similarity_search(vectorstore, queries: Sequence[str], k: int = 4) -> List[List[Document]]:
+    # 先批量计算所有查询的向量，再批量检索，把 2N 次网络往返减少为少数几次
+    if not queries:
+        return []
+    vectors = embed_queries(vectorstore.embeddings, queries)
+    if isinstance(vectorstore, LocalVectorIndex):
+        return vectorstore.search_by_vectors(vectors, k)
+    return pgvector_search_by_vectors(vectorstore, vectors, k)
+
+
+def local_index_path(collection_name: str) -> str:
+    return os.path.join(LOCAL_VECTOR_INDEX_DIR, collection_name)
+
+
+def get_vectorstore(collection_name: str, embeddings: Embeddings):
+    # 根据 VECTOR_STORE 配置返回 PGVector 或本地向量索引，两者都可以传给 batch_similarity_search
+    if VECTOR_STORE == "local":
+        return LocalVectorIndex.load(local_index_path(collection_name), embeddings)
+    if VECTOR_STORE != "pgvector":
+        raise ValueError("Unsupported VECTOR_STORE value.")
+
+    from langchain_postgres.vectorstores import DistanceStrategy, PGVector
+
+    return PGVector(
+        embeddings=embeddings,
+        collection_name=collection_name,
+        connection=os.getenv("DATABASE_URL"),
+        distance_strategy=DistanceStrategy(PGVECTOR_DISTANCE_STRATEGY),
+        use_jsonb=True,
+    )
+
+
+_vectorstore_pool: Dict[Any, Any] = {}
+_vectorstore_pool_lock = threading.Lock()
+
+
+def get_shared_vectorstore(collection_name: str, embedding_model: str):
+    # 向量库和 embeddings 客户端在第一次检索时才创建，之后在进程内的所有会话之间复用，
+    # 页面每次重新执行时不再重新建立数据库连接
+    key = (VECTOR_STORE, collection_name, embedding_model)
+    with _vectorstore_pool_lock:
+        if key not in _vectorstore_pool:
+            from services.llm import get_embedding_model
+
+            start = time.perf_counter()
+            embeddings = get_cached_embeddings(get_embedding_model(embedding_model), embedding_model)
+            _vectorstore_pool[key] = get_vectorstore(collection_name, embeddings)
+            logger.info(f"初始化向量库 {collection_name}（{VECTOR_STORE}）耗时 {time.perf_counter() - start:.3f}s")
+        return _vectorstore_pool[key]
+
+
+def get_cached_embeddings(embeddings: Embeddings, model: str) -> Embeddings:
+    # 相同模型下相同文本的向量只计算一次，重复导入或文本未变化时直接读取磁盘缓存
+    from langchain.embeddings import CacheBackedEmbeddings
+    from langchain.storage import LocalFileStore
+
+    from services.metrics import CacheCountingStore, InstrumentedEmbeddings
+
+    # 记录实际发送的 embeddings 请求和缓存命中数
+    return CacheBackedEmbeddings.from_bytes_store(InstrumentedEmbeddings(embeddings, model),
+                                                  CacheCountingStore(LocalFileStore(EMBEDDING_CACHE_DIR), model),
+                                                  namespace=model, batch_size=EMBEDDING_BATCH_SIZE)
+
+
+def document_id(collection_name: str, document: Document) -> str:
+    # 用集合名和文本内容的哈希作为文档 ID，内容不变的文档在多次导入之间 ID 保持不变
+    return hashlib.sha256(f"{collection_name}\n{document.page_content}".encode("utf-8")).hexdigest()
+
+
+def _pgvector_ids(vectorstore) -> Set[str]:
+    with _pgvector_session() as session:
+        collection = vectorstore.get_collection(session)
+        if not collection:
+            return set()
+        rows = session.query(vectorstore.EmbeddingStore.id).filter(
+            vectorstore.EmbeddingStore.collection_id == collection.uuid)
+        return {row[0] for row in rows}
+
+
+def sync_documents(vectorstore, collection_name: str, documents: Iterable[Document],
+                   batch_size: int = EMBEDDING_BATCH_SIZE) -> Tuple[int, int]:
+    # 增量导入：只计算并写入新增或内容变化的文档，删除已不存在的文档，返回（新增数，删除数）
+    documents = {document_id(collection_name, doc): doc for doc in documents}
+    if isinstance(vectorstore, LocalVectorIndex):
+        existing = {doc.id for doc in vectorstore.documents}
+    else:
+        existing = _pgvector_ids(vectorstore)
+
+    stale = sorted(existing - documents.keys())
+    if stale:
+        vectorstore.delete(ids=stale)
+
+    new_ids = [id_ for id_ in documents if id_ not in existing]
+    for start in range(0, len(new_ids), batch_size):
+        ids = new_ids[start:start + batch_size]
+        batch = [Document(id=id_, page_content=documents[id_].page_content, metadata=documents[id_].metadata)
+                 for id_ in ids]
+        vectors = vectorstore.embeddings.embed_documents([doc.page_content for doc in batch])
+        if isinstance(vectorstore, LocalVectorIndex):
+            vectorstore.add_embeddings(batch, vectors)
+        else:
+            vectorstore.add_embeddings([doc.page_content for doc in batch], vectors,
+                                       metadatas=[doc.metadata for doc in batch], ids=ids)
+    return len(new_ids), len(stale)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from services.comparison import (ADDED, DIFF_FLAG_COLUMN, DIFF_TYPE_COLUMN, HAS_DIFF, MODIFIED, NO_DIFF, REMOVED,
+                                 UNCHANGED, compare_dataframes)
+
+
+def test_compare_nullable_extension_dtypes():
+    # Parquet 等来源的 Int64、string 列包含 pd.NA 时也可以比较，缺失值与缺失值视为相等
+    df1 = pd.DataFrame({
+        "数量": pd.array([1, None, 3], dtype="Int64"),
+        "名称": pd.array(["a", None, "c"], dtype="string"),
+        "金额": [1.0, np.nan, 2.0],
+    })
+    columns = df1.columns.tolist()
+
+    result = compare_dataframes(df1, df1.copy(), columns)
+    assert result[DIFF_FLAG_COLUMN].tolist() == [NO_DIFF] * 3
+
+    df2 = df1.copy()
+    df2.loc[0, "数量"] = 5
+    df2.loc[2, "名称"] = None
+    result = compare_dataframes(df1, df2, columns)
+    assert result[DIFF_FLAG_COLUMN].tolist() == [HAS_DIFF, NO_DIFF, HAS_DIFF]
+    assert result["数量_差异"].tolist() == ["1 --> 5", "", ""]
+    assert result["名称_差异"].tolist() == ["", "", "c --> <NA>"]
+
+
+def test_compare_nullable_with_numpy_dtype():
+    df1 = pd.DataFrame({"数量": pd.array([1, None, 3], dtype="Int64")})
+    df2 = pd.DataFrame({"数量": [1.0, np.nan, 4.0]})
+    result = compare_dataframes(df1, df2, ["数量"])
+    assert result[DIFF_FLAG_COLUMN].tolist() == [NO_DIFF, NO_DIFF, HAS_DIFF]
+
+
+def test_compare_by_keys_mixed_numeric_and_text_keys():
+    # 一侧的关键列因空单元格被读成浮点数（1.0），另一侧为文本（"1"），仍然按相同的值匹配
+    df1 = pd.DataFrame({"编号": [1.0, 2.0, np.nan, 4.0], "数量": [1, 2, 3, 4]})
+    df2 = pd.DataFrame({"编号": ["1", "2", "4", "5"], "数量": [1, 5, 4, 6]})
+    result = compare_dataframes(df1, df2, ["编号", "数量"], ["编号"])
+    types = dict(zip(result["编号"].astype(str), result[DIFF_TYPE_COLUMN]))
+    assert types == {"1.0": UNCHANGED, "2.0": MODIFIED, "nan": REMOVED, "4.0": UNCHANGED, "5": ADDED}
+
+
+def test_compare_by_row_when_second_file_has_more_rows():
+    # 按行号比较时文件2多出的行追加在末尾并显示为差异，不会被丢弃
+    df1 = pd.DataFrame({"编号": [1, 2], "名称": ["a", "b"], "备注": ["x", "y"]})
+    df2 = pd.DataFrame({"编号": [1, 3, 4], "名称": ["a", "b", "c"]})
+    result = compare_dataframes(df1, df2, ["编号", "名称"])
+    assert len(result) == 3
+    assert result["编号"].tolist() == [1, 2, 4]
+    assert result["名称"].tolist() == ["a", "b", "c"]
+    assert result["备注"].tolist()[:2] == ["x", "y"] and pd.isna(result["备注"].iloc[2])
+    assert result["编号_差异"].tolist() == ["", "2 --> 3", "nan --> 4"]
+    assert result["名称_差异"].tolist() == ["", "", "nan --> c"]
+    assert result[DIFF_FLAG_COLUMN].tolist() == [NO_DIFF, HAS_DIFF, HAS_DIFF]
+
+    # 文件1多出的行同样显示为差异
+    result = compare_dataframes(df2, df1[["编号", "名称"]], ["编号", "名称"])
+    assert result["编号_差异"].tolist() == ["", "3 --> 2", "4 --> nan"]
+    assert result[DIFF_FLAG_COLUMN].tolist() == [NO_DIFF, HAS_DIFF, HAS_DIFF]
@@ -0,0 +1,37 @@
+from services.department_matcher import EXACT_MATCH, LLM_MATCH, DepartmentMatcher
+
+CANDIDATES = ["心血管内科", "呼吸内科", "消化内科", "心脏外科", "小儿呼吸科", "新生儿科"] + [
+    f"其他科室{i}" for i in range(100)]
+
+
+def test_shortlist_returns_k_candidates():
+    matcher = DepartmentMatcher(CANDIDATES)
+    # 共享 bigram 的候选不足 k 个，其余名额按共享单字补足
+    shortlist = matcher.shortlist("心内科", k=20)
+    assert len(shortlist) == 20
+    assert {"心血管内科", "心脏外科"} <= set(shortlist)
+    # 名称较长、与大多数候选都不相关时也只返回 k 个
+    shortlist = matcher.shortlist("小儿心脏病专科门诊", k=20)
+    assert len(shortlist) == 20
+    assert shortlist[0] == "心脏外科"
+
+
+def test_shortlist_with_fewer_candidates_than_k():
+    matcher = DepartmentMatcher(CANDIDATES[:3])
+    assert matcher.shortlist("心内科", k=20) == CANDIDATES[:3]
+
+
+def test_bracketed_specialty_goes_to_llm():
+    # 括号中的专科备注不能被当作院区备注丢掉，否则会被精确匹配到上级科室
+    matcher = DepartmentMatcher(["妇科", "计划生育科", "儿科", "小儿呼吸科", "心内科", "泌尿外科"] + CANDIDATES)
+    for name, specialty in [("妇科（计划生育）", "计划生育科"), ("儿科(呼吸)", "小儿呼吸科"), ("心内科(CCU)", "心内科")]:
+        assert matcher.match(name) == (None, LLM_MATCH)
+        assert specialty in matcher.shortlist(name, k=5)
+
+
+def test_campus_notes_are_ignored():
+    matcher = DepartmentMatcher(["心内科", "泌尿外科", "妇科"] + CANDIDATES)
+    assert matcher.match("心内科（东院区）") == ("心内科", EXACT_MATCH)
+    assert matcher.match("泌尿外科【二病区】") == ("泌尿外科", EXACT_MATCH)
+    assert matcher.match("泌尿外科(3号楼)") == ("泌尿外科", EXACT_MATCH)
+    assert matcher.match("妇科门诊(新院区)") == ("妇科", EXACT_MATCH)
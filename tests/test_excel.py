@@ -0,0 +1,39 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import services.excel as excel
+from services.excel import read_table
+
+ENGINES = ["openpyxl", "calamine"] if excel._calamine_available() else ["openpyxl"]
+
+SHEETS = {
+    # 数据行比表头宽、各行长度不一，没有表头的列命名为 Unnamed: n
+    "ragged": [["a", "b"], [1, 2, 3], [4, 5], [6, 7, 8, 9]],
+    "blank_header": [["a", None, "c"], [1, 2, 3], [None, None, None], [4, None, 6]],
+    # 布尔列只在部分块中有空值
+    "bool_with_blanks": [["id", "flag"], [1, True], [2, True], [3, None], [4, False], [5, None], [6, True]],
+}
+
+
+def _workbook(rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    output = BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    output.name = "test.xlsx"
+    return output
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+@pytest.mark.parametrize("sheet", sorted(SHEETS))
+def test_read_table_matches_read_excel(monkeypatch, sheet, chunk_size, engine):
+    monkeypatch.setattr(excel, "_calamine_available", lambda: engine == "calamine")
+    expected = pd.read_excel(_workbook(SHEETS[sheet]))
+    actual = read_table(_workbook(SHEETS[sheet]), chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(actual, expected)
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from services.fake_llm import FakeEmbeddings
+from services.local_vector_index import DOCUMENTS_FILE, VECTORS_FILE, LocalVectorIndex
+
+TEXTS = ["心血管内科", "呼吸内科", "消化内科", "心脏外科", "新生儿科"]
+
+
+def make_documents(texts):
+    return [Document(id=str(i), page_content=text, metadata={"i": i}) for i, text in enumerate(texts)]
+
+
+def make_index():
+    return LocalVectorIndex.from_documents(make_documents(TEXTS), FakeEmbeddings(size=16))
+
+
+def test_from_documents():
+    index = make_index()
+    assert len(index) == len(TEXTS)
+    assert index.vectors.shape == (len(TEXTS), 16)
+    assert index.vectors.dtype == np.float32
+    assert index.vectors.flags["C_CONTIGUOUS"]
+    # 向量已归一化
+    assert np.allclose(np.linalg.norm(index.vectors, axis=1), 1, atol=1e-6)
+    assert [doc.page_content for doc in index.similarity_search("呼吸内科", k=1)] == ["呼吸内科"]
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_load(tmp_path, mmap):
+    index = make_index()
+    directory = str(tmp_path / "index")
+    index.save(directory)
+    assert sorted(os.listdir(directory)) == sorted([VECTORS_FILE, DOCUMENTS_FILE])
+
+    loaded = LocalVectorIndex.load(directory, index.embeddings, mmap=mmap)
+    assert isinstance(loaded.vectors, np.memmap) == mmap
+    assert np.array_equal(loaded.vectors, index.vectors)
+    assert [(doc.id, doc.page_content, doc.metadata) for doc in loaded.documents] == [
+        (doc.id, doc.page_content, doc.metadata) for doc in index.documents]
+    assert loaded.similarity_search("消化内科", k=1)[0].id == "2"
+
+
+def test_save_replaces_existing_index(tmp_path):
+    directory = str(tmp_path / "index")
+    make_index().save(directory)
+    # 已经内存映射的旧索引在被替换后仍然可以读取
+    old = LocalVectorIndex.load(directory, mmap=True)
+
+    index = LocalVectorIndex.from_documents(make_documents(["眼科", "皮肤科"]), FakeEmbeddings(size=16))
+    index.save(directory)
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+    loaded = LocalVectorIndex.load(directory)
+    assert [doc.page_content for doc in loaded.documents] == ["眼科", "皮肤科"]
+    assert np.array_equal(loaded.vectors, index.vectors)
+    assert old.vectors.shape == (len(TEXTS), 16)
+
+
+def test_search_by_vectors_ordering():
+    documents = make_documents(["a", "b", "c", "d"])
+    vectors = np.array([[1, 0], [0.8, 0.6], [0, 1], [-1, 0]], dtype=np.float32)
+    index = LocalVectorIndex(vectors, documents)
+
+    results = index.search_by_vectors([[1, 0], [0, 2], [-1, -0.1]], k=3)
+    assert [[doc.page_content for doc in row] for row in results] == [
+        ["a", "b", "c"], ["c", "b", "a"], ["d", "c", "b"]]
+    # k 大于文档数时返回全部文档
+    assert [doc.page_content for doc in index.search_by_vectors([[1, 0]], k=10)[0]] == ["a", "b", "c", "d"]
+    assert index.search_by_vectors([], k=3) == []
+    assert LocalVectorIndex.empty().search_by_vectors([[1, 0]], k=3) == [[]]
+
+
+def test_add_embeddings_and_delete():
+    index = LocalVectorIndex.empty()
+    index.add_embeddings(make_documents(["a", "b"]), [[3, 0], [0, 2]])
+    assert np.allclose(index.vectors, [[1, 0], [0, 1]])
+
+    index.add_embeddings([Document(id="2", page_content="c")], [[1, 1]])
+    assert len(index) == 3
+    assert index.vectors.flags["C_CONTIGUOUS"]
+    assert [doc.page_content for doc in index.search_by_vectors([[1, 1]], k=1)[0]] == ["c"]
+
+    index.delete(["0", "2", "missing"])
+    assert [doc.id for doc in index.documents] == ["1"]
+    assert np.allclose(index.vectors, [[0, 1]])
+    assert [doc.page_content for doc in index.search_by_vectors([[1, 0]], k=3)[0]] == ["b"]
@@ -0,0 +1,75 @@
+import time
+import warnings
+
+import pandas as pd
+import pytest
+
+import services.rule_compiler as rule_compiler
+from services.rule_compiler import evaluate_spec, parse_rule_spec, validate_spec
+
+
+@pytest.mark.parametrize("pattern", ["(a+)+", "((a+))+$", "(?:a|a)*$", "(a*)*", "(\\d+){2,}", "(?:(a|b))+"])
+def test_validate_spec_rejects_nested_repetition(pattern):
+    assert not validate_spec({"type": "regex", "pattern": pattern})
+
+
+@pytest.mark.parametrize("pattern", ["[A-Za-z]", "1[3-9]\\d{9}", "^(?:男|女)$", "(ab)+", "(?:\\d{3}){2}", "[(a+)]+"])
+def test_validate_spec_accepts_safe_patterns(pattern):
+    assert validate_spec({"type": "regex", "pattern": pattern})
+
+
+@pytest.mark.parametrize("spec", [
+    {"type": "regex", "pattern": "("},
+    {"type": "regex", "pattern": "a", "fullmatch": "yes"},
+    {"type": "length"},
+    {"type": "length", "max": True},
+    {"type": "range", "min": 0, "min_inclusive": 1},
+    {"type": "in", "values": []},
+    {"type": "not", "check": {"type": "unsupported"}},
+    {"type": "all", "checks": []},
+    {"type": "exec", "code": "print(1)"},
+])
+def test_validate_spec_rejects_invalid_specs(spec):
+    assert not validate_spec(spec)
+
+
+def test_parse_rule_spec():
+    assert parse_rule_spec('表达式：{"type": "length", "max": 9}') == {"type": "length", "max": 9}
+    assert parse_rule_spec('{"type": "unsupported"}') is None
+    assert parse_rule_spec("无法编译") is None
+    assert parse_rule_spec('{"type": "regex", "pattern": "(a+)+"}') is None
+
+
+def test_evaluate_spec():
+    texts = pd.Series(["abc", "12", "男", "", "3.5", "a1"], dtype=object)
+    assert evaluate_spec({"type": "regex", "pattern": "[a-z]"}, texts).tolist() == [
+        True, False, False, False, False, True]
+    assert evaluate_spec({"type": "regex", "pattern": "\\d+|男", "fullmatch": True}, texts).tolist() == [
+        False, True, True, False, False, False]
+    assert evaluate_spec({"type": "length", "min": 2, "max": 2}, texts).tolist() == [
+        False, True, False, False, False, True]
+    assert evaluate_spec({"type": "range", "min": 3, "max": 12, "max_inclusive": False}, texts).tolist() == [
+        False, False, False, False, True, False]
+    assert evaluate_spec({"type": "in", "values": ["男", 12]}, texts).tolist() == [
+        False, True, True, False, False, False]
+    spec = {"type": "any", "checks": [{"type": "not", "check": {"type": "regex", "pattern": "."}},
+                                      {"type": "all", "checks": [{"type": "regex", "pattern": "a"},
+                                                                 {"type": "regex", "pattern": "1"}]}]}
+    assert evaluate_spec(spec, texts).tolist() == [False, False, False, True, False, True]
+
+
+def test_evaluate_spec_regex_timeout(monkeypatch):
+    # 绕过校验的回溯爆炸正则在整列上的计算时间受限，超时抛出 TimeoutError
+    monkeypatch.setattr(rule_compiler, "REGEX_TIMEOUT_SECONDS", 0.2)
+    texts = pd.Series(["a" * 40 + "b"] * 5, dtype=object)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        evaluate_spec({"type": "regex", "pattern": "(a|aa)*$"}, texts)
+    assert time.monotonic() - start < 2
+
+
+def test_evaluate_spec_regex_with_groups_does_not_warn():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        result = evaluate_spec({"type": "regex", "pattern": "(ab)c"}, pd.Series(["abc", "x", None], dtype=object))
+    assert result.tolist() == [True, False, False]